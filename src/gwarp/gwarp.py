@@ -4,11 +4,21 @@ which will install the command ``gwarp`` inside your current environment.
 """
 
 import argparse
+import contextlib
 import logging
 import sys
 import os
 import glob
+import hashlib
+import io
+import json
+import math
+import shlex
+import struct
+import tarfile
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from osgeo import gdal
 
 from gwarp import __version__
@@ -19,6 +29,65 @@ __license__ = "MIT"
 
 _logger = logging.getLogger(__name__)
 
+# seconds a shard waits for another shard building the index (and between checks)
+SHARD_LOCK_TIMEOUT = 3600
+SHARD_LOCK_POLL = 1
+
+# interpolations supported by the numpy engine
+NUMPY_INTERPOLATIONS = ('nearest', 'bilinear')
+# rows of the output warped per task by the numpy engine
+NUMPY_BLOCK_ROWS = 256
+# largest src (width * height pixels) for which '--engine auto' picks numpy, by band count and data type.
+# These defaults are NOT calibrated: they spread a 16 MiB src over the bands and bytes per sample.
+# Run the engine crossover benchmark of 'tests/bench.bat' and pass its CSV with --engine-calibration
+# (or update this table from it, see read_engine_calibration)
+NUMPY_MAX_BYTES = 16 * 2**20
+NUMPY_MAX_PIXELS = {
+    (bands, dtype): NUMPY_MAX_BYTES // (bands * size)
+    for bands in (1, 3, 4)
+    for dtype, size in (('uint8', 1), ('uint16', 2), ('float32', 4))
+}
+
+VIPS_NUMPY_TYPES = {
+    'uchar': 'uint8',
+    'char': 'int8',
+    'ushort': 'uint16',
+    'short': 'int16',
+    'uint': 'uint32',
+    'int': 'int32',
+    'float': 'float32',
+    'double': 'float64',
+}
+NUMPY_VIPS_TYPES = {v: k for k, v in VIPS_NUMPY_TYPES.items()}
+
+# band formats in the order of the vips enum (as stored in the header of .v files)
+VIPS_BAND_FORMATS = ['uchar', 'char', 'ushort', 'short', 'uint', 'int', 'float', 'complex', 'double', 'dpcomplex']
+VIPS_HEADER_SIZE = 64
+VIPS_MAGIC_INTEL = b'\xb6\xa6\xf2\x08'
+VIPS_MAGIC_SPARC = b'\x08\xf2\xa6\xb6'
+
+# output formats (-of) and their file extension
+FORMAT_SUFFIXES = {
+    'GTiff': '.tif',
+    'PNG': '.png',
+    'JPEG': '.jpg',
+    'WEBP': '.webp',
+}
+
+# geoinformation of files without (e.g. .v indexes)
+SIDECAR_EXT = '.json'
+
+NUMPY_GDAL_TYPES = {
+    'uint8': gdal.GDT_Byte,
+    'uint16': gdal.GDT_UInt16,
+    'int16': gdal.GDT_Int16,
+    'uint32': gdal.GDT_UInt32,
+    'int32': gdal.GDT_Int32,
+    'float32': gdal.GDT_Float32,
+    'float64': gdal.GDT_Float64,
+}
+NUMPY_DTYPES = {v: k for k, v in NUMPY_GDAL_TYPES.items()}
+
 
 # ---- Python API ----
 # The functions defined in this section can be imported by users in their
@@ -27,12 +96,27 @@ _logger = logging.getLogger(__name__)
 # when using this Python module as a library.
 
 
-def gwarp(args):
+def gwarp(args, indexCache=None):
+    """Warp all files matching ``args.src`` through a single index
+
+    Args:
+      args (argparse.Namespace): parsed options (see :func:`parse_args`)
+      indexCache (dict): optional cache shared between calls; indexes with the
+        same source grid and warp parameters are only created once
+
+    Returns:
+      List[str]: the written output files (``None`` if nothing could be done)
+    """
 
     if args.vips:
         os.environ['PATH'] = args.vips + ';' + os.environ['PATH']
     
-    import pyvips
+    pyvips = load_pyvips()
+
+    engine_name = args.engine
+    if pyvips is None and engine_name == 'vips':
+        _logger.warning('pyvips is not available; using the numpy engine')
+        engine_name = 'numpy'
 
     src_names = glob.glob(args.src,recursive=True)
 
@@ -43,262 +127,1367 @@ def gwarp(args):
 
     src_multi = src_count > 1
 
+    if args.mosaic:
+        return gwarp_mosaic(args, src_names, engine_name if engine_name != 'auto' else 'vips' if pyvips else 'numpy', indexCache)
     
     srcNodataDic = None if args.srcNodata is not None else {} 
 
-    if args.vii == None:
-        # gdal read files; get max size and projection/geotransform
+    vii = args.vii
+    grid = None
+    buildIndex = False
+    if vii == None and args.shard is not None and args.vio:
+        # the index is built once for all shards; the others wait for it and read it
+        # (an existing index is only reused if it was built with the same parameters)
+        grid = src_grid(args, src_names, srcNodataDic)
+        if grid is None:
+            return
+        buildIndex = acquire_index_lock(args.vio, index_digest(index_key(args, *grid)))
+        if not buildIndex:
+            _logger.info(f'Reading index built by another shard: {args.vio}')
+            vii = args.vio
+
+    try:
+        loaded = load_index(args, vii, src_names, srcNodataDic, indexCache, grid)
+    finally:
+        if buildIndex:
+            release_index_lock(args.vio)
+
+    if loaded is None:
+        return
+    index, projection, geotransform, xSize, ySize = loaded
 
-        xSize = ySize = -1
+    vips_resample = vips_interpolation(args)
 
-        for name in src_names:
-            print(name)
-            dataset = gdal.Open(name, gdal.GA_ReadOnly)
-            if (dataset.RasterXSize > xSize or dataset.RasterYSize > ySize ):
-                xSize = dataset.RasterXSize
-                ySize = dataset.RasterYSize
-                projection   = dataset.GetProjection()
-                geotransform = dataset.GetGeoTransform()
-            if srcNodataDic is not None:
-                srcNodataDic[name] = dataset.GetRasterBand(1).GetNoDataValue()
-           
+    dst_suffix = '_gwarp'
+    dst_folder = dst_name = dst_ext = None 
 
-        if args.vs:
-            xSize = args.vs[0]
-            ySize = args.vs[1]
-      
-        if projection == '' or geotransform == (0.0, 1.0, 0.0, 0.0, 0.0, 1.0):
-            print('src is missing a projection and/or geotransform')
-            return 
+    # stream to stdout or a file-like object instead of writing files
+    stream = tar = None
+    sharedTar = isinstance(args.dst, tarfile.TarFile)
+    if sharedTar:
+        # tar shared by the jobs of a batch run (closed by gwarp_batch)
+        tar = stream = args.dst
+    elif args.dst == '-':
+        stream = sys.stdout.buffer
+    elif hasattr(args.dst, 'write'):
+        stream = args.dst
 
-        # select proper types and interpolation methods for GDAL, Numpy & VIPS
-        maxUInt16 = np.iinfo(np.uint16).max
-        maxFloat32 = np.finfo(np.float32).max
-        ltMaxUInt16 = (xSize < maxUInt16 and ySize < maxUInt16)
+    if args.format:
+        dst_ext = FORMAT_SUFFIXES[args.format]
 
-        maxUInt = maxUInt16 if ltMaxUInt16 else 2**32-1
+    # define dst defaults for single and multi src
+    if stream is not None:
+        dst_folder = '.'
+    elif args.dst:
+        name_split = os.path.splitext(os.path.basename(args.dst))
+        dst_name = name_split[0]
+        dst_suffix = f'_{name_split[0]}' if name_split[0] != '' and src_multi else ''
+        dst_ext = name_split[1] or dst_ext
+        dst_folder = os.path.dirname(args.dst)
+        if dst_folder == '':
+            dst_folder = '.'
+
+        if not os.path.exists(dst_folder):
+            os.makedirs(dst_folder)
 
-        np_index_type = 'uint16' if ltMaxUInt16 else 'uint32'
-        gdal_index_type = gdal.GDT_UInt16 if ltMaxUInt16 else gdal.GDT_UInt32
-        gdal_index_warp_type = gdal.GDT_Float32
-        dstNodataMax = maxFloat32
-        vips_index_type = 'float'
+    srcScale = None
+    if args.shrink == 'on' or (args.shrink == 'auto' and vips_resample != 'nearest'):
+        srcScale = index_scale(index, xSize, ySize)
+        _logger.info(f'Index samples {srcScale[0]:.2f}x{srcScale[1]:.2f} src pixels per dst pixel')
 
-        if args.resampleAlg == 'near' or args.resampleAlg == None:
-            gdal_index_warp_type = gdal_index_type
-            dstNodataMax = maxUInt16
-            vips_index_type = 'ushort' if ltMaxUInt16 else 'uint'
-            
+    calibration = read_engine_calibration(args.engineCalibration) if args.engineCalibration else None
+
+    engine_indexes = {}
+    outputs = []
+    results = {}
 
-        # create vips index
-        _logger.info(f'Creating index: {xSize}x{ySize} type:{vips_index_type}')
+    shard_names = src_names if args.shard is None else shard_files(src_names, *args.shard)
+
+    # START LOOP on src files
+    for name in shard_names:
+        name_split = os.path.splitext(os.path.basename(name))
         
-        index = pyvips.Image.xyz(xSize, ySize)
+        if not dst_folder:
+            dst_folder = os.path.dirname(name)
         
-        if ltMaxUInt16:
-            index = index.cast('ushort')
+        if not dst_name or src_multi:
+            dst_name = name_split[0]
+        
+        if not dst_ext:
+            dst_ext = name_split[1] 
             
-         # vips2np
-        np_index = np.ndarray(buffer=index.write_to_memory(), shape=[ySize, xSize, 2], dtype=np_index_type)
+        output = f'{dst_folder}/{dst_name}{dst_suffix}{dst_ext}'
+        
+        if stream is None and os.path.exists(output) and not args.overwrite:
+            _logger.warning(f'Output dataset {output} exists,\ndelete the file or use -overwrite and run again')
+            results[name] = {'output': output, 'status': 'exists'}
+            continue
 
-        # np2gdal
-        gdal_index = gdal.GetDriverByName('MEM').Create('', xSize, ySize, 2, gdal_index_type)
+        if args.srcNodata is not None:
+            srcNodata = args.srcNodata
+        else:
+            srcNodata = [srcNodataDic[name]] if srcNodataDic[name] is not None else None
 
-        gdal_index.GetRasterBand(1).WriteArray(np_index[:, :, 0])
-        gdal_index.GetRasterBand(2).WriteArray(np_index[:, :, 1])
+        engine = engine_name if engine_name != 'auto' else select_engine(name, vips_resample, calibration)
+        if engine not in engine_indexes:
+            engine_indexes[engine] = index_to_vips(index) if engine == 'vips' else index_to_numpy(index)
 
-        # slower
-        # band1.WriteArray(np.tile(np.linspace(0, xSize, xSize, dtype= np_index_type,endpoint=False), (ySize, 1)))
-        # band2.WriteArray(np.tile(np.linspace(0, ySize, ySize, dtype= np_index_type,endpoint=False).reshape((-1, 1)), (1, xSize)))
+        _logger.info(f'Warping file: {name} (engine: {engine})')
+        image, noData = ENGINES[engine](name, engine_indexes[engine], xSize, ySize, srcNodata, vips_resample, args, srcScale)
 
-        # gdal set metadata
-        
-        gdal_index.SetProjection( projection )
-        gdal_index.SetGeoTransform( geotransform )
-
-        gdal_resample = {
-            'near': gdal.GRA_NearestNeighbour,
-            'bilinear': gdal.GRA_Bilinear,
-            'cubic': gdal.GRA_Cubic,
-            'cubicspline': gdal.GRA_CubicSpline,
-            'lanczos': gdal.GRA_CubicSpline,
-        }[args.resampleAlg]
-
-        _logger.info('Warping index')
-        # gdal warp
-        gdal_index = gdal.Warp('', gdal_index,
-                                    format='MEM',
-                                    outputType = gdal_index_warp_type,
-                                    resampleAlg = gdal_resample,
-                                    #srcNodata = maxUInt,
-                                    dstNodata = dstNodataMax,
-                                    outputBounds = args.outputBounds,
-                                    outputBoundsSRS = args.outputBoundsSRS,
-                                    xRes = args.xyRes[0] if args.xyRes != None else None,
-                                    yRes = args.xyRes[1] if args.xyRes != None else None,
-                                    targetAlignedPixels = args.targetAlignedPixels,
-                                    width = args.widthHeight[0] if args.widthHeight != None else None,
-                                    height = args.widthHeight[1] if args.widthHeight != None else None,
-                                    srcSRS = args.srcSRS,
-                                    dstSRS = args.dstSRS,
-                                    multithread = args.multithread)
-
-
-        # gdal read new metadata
-        projection   = gdal_index.GetProjection()
-        geotransform = gdal_index.GetGeoTransform()
-
-        # gdal2np
-        band1 = gdal_index.GetRasterBand(1)
-        band2 = gdal_index.GetRasterBand(2)
-
-        band1 = band1.ReadAsArray()
-        band2 = band2.ReadAsArray()
-        
-        np_index = np.moveaxis(np.array([band1,band2]), 0, -1)
-        height, width, bands = np_index.shape
-        np_index = np_index.reshape(width * height * bands)
+        if stream is None:
+            write_to_file(image, output, args.co, projection, geotransform, noData=noData)
+        else:
+            data = write_to_buffer(image, dst_ext, args.co, projection, geotransform, noData=noData)
+            if src_multi or sharedTar:
+                # several files are streamed as tar
+                tar = tar or tarfile.open(fileobj=stream, mode='w|')
+                add_to_tar(tar, output, data)
+            else:
+                stream.write(data)
 
-        # np2vips
-        index = pyvips.Image.new_from_memory(np_index.data, width, height, bands, vips_index_type)
-        
+        outputs.append(output)
+        results[name] = {'output': output, 'status': 'written'}
 
-        # write the index file
-        if args.vio:
-            _logger.info(f'Writing index: {args.vio}')
-            dst_folder = os.path.dirname(args.vio)
-            if not os.path.exists(dst_folder):
-                os.makedirs(dst_folder)
-            write_to_file(index, args.vio, args.co, projection, geotransform,{'SrcXSize':str(xSize),'SrcYSize':str(ySize)})
+    if not sharedTar:
+        if tar is not None:
+            tar.close()
+        if stream is not None:
+            stream.flush()
 
-    else: #args.vii != None
-        _logger.info(f'Reading index: {args.vii}')
-        index = gdal.Open(args.vii, gdal.GA_ReadOnly)
-        projection   = index.GetProjection()
-        geotransform = index.GetGeoTransform()
-        if projection == '' or geotransform == (0.0, 1.0, 0.0, 0.0, 0.0, 1.0):
-            _logger.warning('The index is missing a projection and/or geotransform')
-    
-        if args.vs:
-            xSize = args.vs[0]
-            ySize = args.vs[1]
+    if args.summary:
+        write_summary(args.summary, {
+            'src': args.src,
+            'shard': args.shard,
+            'src_count': src_count,
+            'files': results,
+        })
+
+    return outputs
+
+
+def gwarp_mosaic(args, src_names, engine, indexCache=None):
+    """Warp all src files into a single output grid and composite them (``--mosaic``)
+
+    The grid is derived from all src files and the warp parameters (-te, -tr, -ts, -t_srs, ...).
+    Every src file gets its own index onto the window of that grid it covers, so only
+    its footprint is warped.
+    With vips all files are composited lazily and the output is computed in a single pass
+    while it is written.
+
+    Returns:
+      List[str]: the written output file (``None`` if nothing could be done)
+    """
+    if args.vio or args.vii or args.shard:
+        _logger.warning('--vio, --vii and --shard are ignored in mosaic mode')
+
+    if args.dst is None:
+        print('mosaic needs a dst file')
+        return
+
+    # 'first' and 'last' follow the (sorted) order of the src files
+    src_names = sorted(src_names)
+
+    # the dst grid of all src files
+    _logger.info('Creating mosaic grid')
+    grid = gdal.Warp('', src_names,
+                        format='VRT',
+                        outputBounds = args.outputBounds,
+                        outputBoundsSRS = args.outputBoundsSRS,
+                        xRes = args.xyRes[0] if args.xyRes != None else None,
+                        yRes = args.xyRes[1] if args.xyRes != None else None,
+                        targetAlignedPixels = args.targetAlignedPixels,
+                        width = args.widthHeight[0] if args.widthHeight != None else None,
+                        height = args.widthHeight[1] if args.widthHeight != None else None,
+                        srcSRS = args.srcSRS,
+                        dstSRS = args.dstSRS)
+    projection   = grid.GetProjection()
+    geotransform = grid.GetGeoTransform()
+    width  = grid.RasterXSize
+    height = grid.RasterYSize
+    grid = None
+
+    # the indexes of all src files are warped onto exactly this grid
+    gridArgs = argparse.Namespace(**vars(args))
+    gridArgs.outputBounds = [geotransform[0], geotransform[3] + geotransform[5] * height,
+                             geotransform[0] + geotransform[1] * width, geotransform[3]]
+    gridArgs.outputBoundsSRS = None
+    gridArgs.xyRes = None
+    gridArgs.targetAlignedPixels = False
+    gridArgs.widthHeight = [width, height]
+    gridArgs.dstSRS = projection
+
+    vips_resample = vips_interpolation(args)
+
+    mosaic = None
+    noData = args.dstNodata
+    mosaicNoData = None
+
+    for name in src_names:
+        dataset = gdal.Open(name, gdal.GA_ReadOnly)
+        xSize = dataset.RasterXSize
+        ySize = dataset.RasterYSize
+        srcProjection = dataset.GetProjection()
+        srcGeotransform = dataset.GetGeoTransform()
+        if srcProjection == '' or srcGeotransform == (0.0, 1.0, 0.0, 0.0, 0.0, 1.0):
+            print(f'{name}: src is missing a projection and/or geotransform')
+            return
+
+        if args.srcNodata is not None:
+            srcNodata = args.srcNodata
         else:
-            metadata = index.GetMetadata()
-    
-            xSize = int(metadata["SrcXSize"])
-            ySize = int(metadata["SrcYSize"])
+            srcNodata = dataset.GetRasterBand(1).GetNoDataValue()
+            srcNodata = [srcNodata] if srcNodata is not None else None
+
+        # all files share the nodata values marking the empty pixels of the mosaic
+        if noData is None:
+            noData = srcNodata if srcNodata is not None else [0]
+        fileArgs = argparse.Namespace(**vars(args))
+        fileArgs.dstNodata = noData
+
+        # the index only covers the window of the mosaic grid the file falls into
+        window = mosaic_window(dataset, args.srcSRS, projection, geotransform, width, height)
+        if window is None:
+            _logger.warning(f'{name} is outside of the mosaic')
+            continue
+        windowArgs = window_args(gridArgs, geotransform, window)
 
-        if srcNodataDic is not None:
-            for name in src_names:
-                dataset = gdal.Open(name, gdal.GA_ReadOnly)
-                srcNodataDic[name] = dataset.GetRasterBand(1).GetNoDataValue()
+        key = index_key(windowArgs, xSize, ySize, srcProjection, srcGeotransform)
+        if indexCache is not None and key in indexCache:
+            index = indexCache[key][0]
+        else:
+            index, windowProjection, windowGeotransform = create_index(windowArgs, xSize, ySize, srcProjection, srcGeotransform)
+            if indexCache is not None:
+                indexCache[key] = (index, windowProjection, windowGeotransform)
+        index = index_to_vips(index) if engine == 'vips' else index_to_numpy(index)
+
+        footprint = index_footprint(index, xSize, ySize)
+        if footprint is None:
+            _logger.warning(f'{name} is outside of the mosaic')
+            continue
+        left, top, w, h = footprint
+        index = index.crop(left, top, w, h) if engine == 'vips' else index[top:top + h, left:left + w]
+        footprint = (window[0] + left, window[1] + top, w, h)
+
+        srcScale = None
+        if args.shrink == 'on' or (args.shrink == 'auto' and vips_resample != 'nearest'):
+            srcScale = index_scale(index, xSize, ySize)
+
+        _logger.info(f'Warping file: {name} (engine: {engine})')
+        image, mosaicNoData = ENGINES[engine](name, index, xSize, ySize, srcNodata, vips_resample, fileArgs, srcScale)
+        mosaic = composite(mosaic, image, footprint, width, height, mosaicNoData, args.mosaic)
+
+    if mosaic is None:
+        print('no src file is inside of the mosaic')
+        return
+
+    name_split = os.path.splitext(os.path.basename(src_names[0]))
+    dst_ext = FORMAT_SUFFIXES[args.format] if args.format else name_split[1]
+
+    if isinstance(args.dst, tarfile.TarFile):
+        output = f'mosaic{dst_ext}'
+        add_to_tar(args.dst, output, write_to_buffer(mosaic, dst_ext, args.co, projection, geotransform, noData=mosaicNoData))
+    elif args.dst == '-' or hasattr(args.dst, 'write'):
+        stream = sys.stdout.buffer if args.dst == '-' else args.dst
+        output = f'mosaic{dst_ext}'
+        stream.write(write_to_buffer(mosaic, dst_ext, args.co, projection, geotransform, noData=mosaicNoData))
+        stream.flush()
+    else:
+        output = args.dst if os.path.splitext(args.dst)[1] else args.dst + dst_ext
+        if os.path.exists(output) and not args.overwrite:
+            _logger.warning(f'Output dataset {output} exists,\ndelete the file or use -overwrite and run again')
+            return []
+        dst_folder = os.path.dirname(output)
+        if dst_folder and not os.path.exists(dst_folder):
+            os.makedirs(dst_folder)
+        write_to_file(mosaic, output, args.co, projection, geotransform, noData=mosaicNoData)
 
-        index = pyvips.Image.new_from_file(args.vii)
+    return [output]
 
 
-    vips_resample = args.v_inter if args.v_inter != None else {
+def vips_interpolation(args):
+    """The vips interpolation for the gdal resampling method (unless set explicitly with --vi)"""
+    return args.v_inter if args.v_inter != None else {
         'near':'nearest',
         'bilinear':'bilinear',
         'cubic':'bicubic',
         'cubicspline':'vsqbs',
         'lanczos':'vsqbs'
     }[args.resampleAlg] if args.resampleAlg != None else 'nearest'
+
+
+def mosaic_window(dataset, srcSRS, projection, geotransform, width, height):
+    """Window ``(left, top, width, height)`` of the mosaic grid covered by a src file
+
+    The bounds of the src warped to the projection of the mosaic are snapped outwards
+    to its pixels (with a margin of a pixel for the interpolation).
+
+    Returns:
+      tuple: the window clipped to the mosaic (``None`` if the file is outside of it)
+    """
+    vrt = gdal.Warp('', dataset, format='VRT', srcSRS=srcSRS, dstSRS=projection,
+                    xRes=geotransform[1], yRes=abs(geotransform[5]))
+    vrtGeotransform = vrt.GetGeoTransform()
+    minX = vrtGeotransform[0]
+    maxX = minX + vrtGeotransform[1] * vrt.RasterXSize
+    maxY = vrtGeotransform[3]
+    minY = maxY + vrtGeotransform[5] * vrt.RasterYSize
+    vrt = None
+
+    left = max(math.floor((minX - geotransform[0]) / geotransform[1]) - 1, 0)
+    right = min(math.ceil((maxX - geotransform[0]) / geotransform[1]) + 1, width)
+    top = max(math.floor((maxY - geotransform[3]) / geotransform[5]) - 1, 0)
+    bottom = min(math.ceil((minY - geotransform[3]) / geotransform[5]) + 1, height)
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right - left, bottom - top
+
+
+def window_args(gridArgs, geotransform, window):
+    """Warp options creating the index of a window of the mosaic grid"""
+    left, top, w, h = window
+    windowArgs = argparse.Namespace(**vars(gridArgs))
+    windowArgs.outputBounds = [geotransform[0] + geotransform[1] * left, geotransform[3] + geotransform[5] * (top + h),
+                               geotransform[0] + geotransform[1] * (left + w), geotransform[3] + geotransform[5] * top]
+    windowArgs.widthHeight = [w, h]
+    return windowArgs
+
+
+def index_footprint(index, xSize, ySize):
+    """Bounding box ``(left, top, width, height)`` of the index pixels inside the src (``None`` if there are none)"""
+    if isinstance(index, np.ndarray):
+        valid = (index[..., 0] < xSize) & (index[..., 1] < ySize)
+        columns = valid.any(axis=0)
+        rows = valid.any(axis=1)
+    else:
+        columns, rows = (index < [xSize, ySize]).bandand().project()
+        columns = np.ndarray(buffer=columns.cast('double').write_to_memory(), shape=[columns.width], dtype=np.float64) > 0
+        rows = np.ndarray(buffer=rows.cast('double').write_to_memory(), shape=[rows.height], dtype=np.float64) > 0
+
+    columns = np.flatnonzero(columns)
+    rows = np.flatnonzero(rows)
+    if len(columns) == 0 or len(rows) == 0:
+        return None
+    return int(columns[0]), int(rows[0]), int(columns[-1] - columns[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+def composite(mosaic, image, footprint, width, height, noData, mode):
+    """Composite a warped footprint into the mosaic (pixels equal to ``noData`` in all bands are empty)
+
+    Args:
+      mosaic: the mosaic so far (``None`` for the first file)
+      image: the warped footprint (vips image or numpy array)
+      footprint (tuple): ``(left, top, width, height)`` of the footprint in the mosaic
+      noData (list): the nodata value per band
+      mode (str): 'first', 'last' or 'max' (the pixel kept where files overlap; 'max'
+        keeps the pixel with the larger sum of its bands)
+    """
+    left, top, w, h = footprint
+
+    if isinstance(image, np.ndarray):
+        if mosaic is None:
+            mosaic = np.full((height, width, image.shape[2]), noData, dtype=image.dtype)
+        region = mosaic[top:top + h, left:left + w]
+        empty = (region == noData).all(axis=-1, keepdims=True)
+        valid = (image != noData).any(axis=-1, keepdims=True)
+        if mode == 'first':
+            take = empty & valid
+        elif mode == 'last':
+            take = valid
+        else:
+            # whole pixels are compared (by the sum of their bands), bands are never mixed
+            brighter = image.sum(axis=-1, keepdims=True, dtype=np.float64) > region.sum(axis=-1, keepdims=True, dtype=np.float64)
+            take = (brighter | empty) & valid
+        np.copyto(region, image.astype(mosaic.dtype, copy=False), where=take)
+        return mosaic
+
+    image = image.embed(left, top, width, height, extend='background', background=noData)
+    if mosaic is None:
+        return image
+    empty = (mosaic == noData).bandand()
+    if mode == 'first':
+        return empty.ifthenelse(image, mosaic)
+    valid = (image != noData).bandor()
+    if mode == 'last':
+        return valid.ifthenelse(image, mosaic)
+    # whole pixels are compared (by the mean of their bands), bands are never mixed
+    brighter = image.cast('double').bandmean() > mosaic.cast('double').bandmean()
+    return ((brighter | empty) & valid).ifthenelse(image, mosaic)
+
+
+def warp_vips(name, index, xSize, ySize, srcNodata, interpolation, args, srcScale=None):
+    """Apply the index to a single file with ``vips mapim``
+
+    Returns:
+      tuple: the warped vips image and its nodata value per band
+    """
+    import pyvips
+
+    interp = pyvips.vinterpolate.Interpolate.new(interpolation)
+    srcNodata = nodata_values(srcNodata)
+
+    _logger.info(f'Reading file: {name}')
+    image = pyvips.Image.new_from_file(name)
+
+    # nodata values must not be averaged into their valid neighbours
+    if srcScale is not None and srcNodata is None:
+        shrink = shrink_factor(srcScale, image.width/xSize, image.height/ySize)
+        if shrink > 1:
+            image = shrink_on_load(name, image, shrink)
+
+    if (image.width == xSize and image.height == ySize ):
+        idx = index 
+    else:
+        # pixel centres of the src stay aligned with those of the shrunk image
+        wfac = image.width/xSize
+        hfac = image.height/ySize
+        if interpolation == 'nearest':
+            # vips truncates the coordinate, so the index points at the pixel the centre falls into
+            idx = (index + 0.5) * [wfac, hfac]
+        else:
+            idx = (index + 0.5) * [wfac, hfac] - 0.5
+            idx = (idx < 0).ifthenelse(0, idx)
+
+    noData, masked = nodata_params(srcNodata, args.dstNodata, image.bands)
+    if masked:
+        # the alpha band is warped along with the image and carries both the src nodata
+        # pixels and the pixels outside the src (mapim fills them with 0)
+        image = image.bandjoin(nodata_alpha(image, srcNodata))
+
+    image = image.mapim( idx, interpolate=interp)
     
-    interp = pyvips.vinterpolate.Interpolate.new(vips_resample)
+    if masked:
+        bands = image.bands - 1
+        image = (image[bands] > 127).ifthenelse(image.extract_band(0, n=bands), noData)
 
-    dst_suffix = '_gwarp'
-    dst_folder = dst_name = dst_ext = None 
+    return image, noData
 
-    # define dst defaults for single and multi src
-    if args.dst:
-        name_split = os.path.splitext(os.path.basename(args.dst))
-        dst_name = name_split[0]
-        dst_suffix = f'_{name_split[0]}' if name_split[0] != '' and src_multi else ''
-        dst_ext = name_split[1]
-        dst_folder = os.path.dirname(args.dst)
-        if dst_folder == '':
-            dst_folder = '.'
 
-        if not os.path.exists(dst_folder):
-            os.makedirs(dst_folder)
+def warp_numpy(name, index, xSize, ySize, srcNodata, interpolation, args, srcScale=None):
+    """Apply the index to a single file with numpy (read with gdal)
 
-    idx_mask = None
+    The output is gathered in blocks of rows on a thread pool. Only the 'nearest' and
+    'bilinear' interpolations are supported; all others fall back to 'bilinear'.
+
+    Returns:
+      tuple: the warped numpy array of shape ``(height, width, bands)`` and its nodata value per band
+    """
+    if interpolation not in NUMPY_INTERPOLATIONS:
+        _logger.warning(f'The numpy engine does not support {interpolation}; using bilinear')
+        interpolation = 'bilinear'
+    srcNodata = nodata_values(srcNodata)
+
+    _logger.info(f'Reading file: {name}')
+    dataset = gdal.Open(name, gdal.GA_ReadOnly)
+    shrink = 1
+    if srcScale is not None and srcNodata is None:
+        shrink = shrink_factor(srcScale, dataset.RasterXSize/xSize, dataset.RasterYSize/ySize)
+    if shrink > 1:
+        # gdal reads from the overviews if there are any
+        _logger.info(f'Shrinking on load: {shrink}')
+        image = dataset.ReadAsArray(buf_xsize=dataset.RasterXSize//shrink, buf_ysize=dataset.RasterYSize//shrink,
+                                    resample_alg=gdal.GRIORA_Average)
+    else:
+        image = dataset.ReadAsArray()
+    image = image[:, :, np.newaxis] if image.ndim == 2 else np.moveaxis(image, 0, -1)
+    height, width, bands = image.shape
+
+    noData, masked = nodata_params(srcNodata, args.dstNodata, bands)
+    if masked:
+        alpha = nodata_alpha(image, srcNodata)
+        image = np.dstack([image, alpha.astype(image.dtype)])
+        noDataBands = np.array(noData)
+
+    wfac = width/xSize
+    hfac = height/ySize
+    warped = np.zeros(index.shape[:2] + (bands,), dtype=image.dtype)
+
+    def warp_block(row):
+        rows = slice(row, row + NUMPY_BLOCK_ROWS)
+        # pixel centres of the src stay aligned with those of the shrunk image
+        x = np.maximum((index[rows, :, 0] + np.float32(0.5)) * np.float32(wfac) - np.float32(0.5), 0)
+        y = np.maximum((index[rows, :, 1] + np.float32(0.5)) * np.float32(hfac) - np.float32(0.5), 0)
+        valid = (x < width) & (y < height)
+        x0 = np.clip(np.floor(x), 0, width - 1).astype(np.intp)
+        y0 = np.clip(np.floor(y), 0, height - 1).astype(np.intp)
+
+        if interpolation == 'nearest':
+            # the pixel the centre falls into (like vips, which truncates (index + 0.5) * f)
+            block = image[np.clip(np.floor(y + 0.5), 0, height - 1).astype(np.intp),
+                          np.clip(np.floor(x + 0.5), 0, width - 1).astype(np.intp)]
+        else:
+            x1 = np.minimum(x0 + 1, width - 1)
+            y1 = np.minimum(y0 + 1, height - 1)
+            fx = (x - x0)[..., np.newaxis]
+            fy = (y - y0)[..., np.newaxis]
+            top = image[y0, x0] * (1 - fx) + image[y0, x1] * fx
+            bottom = image[y1, x0] * (1 - fx) + image[y1, x1] * fx
+            block = top * (1 - fy) + bottom * fy
+
+        if masked:
+            keep = (block[..., -1] > 127) & valid
+            block = np.where(keep[..., np.newaxis], block[..., :-1], noDataBands)
+        else:
+            block[~valid] = 0
+
+        if np.issubdtype(image.dtype, np.integer):
+            block = np.rint(block)
+        warped[rows] = block
+
+    with ThreadPoolExecutor() as pool:
+        list(pool.map(warp_block, range(0, warped.shape[0], NUMPY_BLOCK_ROWS)))
+
+    return warped, noData
+
+
+def nodata_params(srcNodata, dstNodata, bands):
+    """Decide the nodata handling of a src file with ``bands`` bands
+
+    The dst nodata defaults to the src nodata. A src pixel is nodata if all of its bands
+    equal their src nodata value. Masking is skipped if all nodata values are 0, as
+    the engines fill the pixels outside the src with 0 anyway.
+
+    Returns:
+      tuple: the dst nodata value per band (``None`` if there is none) and whether the
+      src nodata pixels and the pixels outside the src have to be masked with it
+    """
+    srcNodata = nodata_values(srcNodata)
+    dstNodata = nodata_values(dstNodata)
+    if srcNodata is None and dstNodata is None:
+        return None, False
+
+    noData = nodata_per_band(dstNodata if dstNodata is not None else srcNodata, bands)
+    masked = any(value != 0 for value in noData) or (srcNodata is not None and any(value != 0 for value in nodata_per_band(srcNodata, bands)))
+    return noData, masked
+
+
+def nodata_values(noData):
+    """The nodata values (``None`` if there are none; like gdalwarp, ``'None'`` values mean no nodata)"""
+    if noData is None:
+        return None
+    if not isinstance(noData, (list, tuple)):
+        noData = [noData]
+    return None if all(value is None for value in noData) else noData
+
+
+def nodata_per_band(noData, bands):
+    """One nodata value per band (like gdalwarp, the last value is used for the remaining bands)
+
+    A single value (e.g. ``dstNodata=50`` of older API callers) is used for all bands.
+    """
+    if not isinstance(noData, (list, tuple)):
+        noData = [noData]
+    return [noData[min(i, len(noData) - 1)] for i in range(bands)]
+
+
+def nodata_alpha(image, srcNodata):
+    """Alpha band (0 or 255) of the valid pixels of a vips image or numpy array of shape ``(height, width, bands)``"""
+    if isinstance(image, np.ndarray):
+        if srcNodata is None:
+            return np.full(image.shape[:2], 255, dtype=np.uint8)
+        return ((image != np.array(nodata_per_band(srcNodata, image.shape[2]), dtype=image.dtype)).any(axis=-1) * 255).astype(np.uint8)
+
+    if srcNodata is None:
+        return image.new_from_image(255).cast('uchar')
+    return (image != nodata_per_band(srcNodata, image.bands)).bandor()
+
+
+def nodata_tag(noData):
+    """The nodata value stored in a file (GeoTIFF stores a single one for all bands)"""
+    if isinstance(noData, (list, tuple)):
+        if len(set(noData)) > 1:
+            _logger.warning(f'Nodata values differ per band {noData}; the file stores only {noData[0]}')
+        return noData[0]
+    return noData
+
+
+def index_scale(index, xSize, ySize):
+    """Estimate how many src pixels a single dst pixel of the index covers
+
+    The estimate is the median step between neighbouring pixels of the middle row and
+    the middle column of the index (pixels outside the src are ignored).
+
+    Returns:
+      tuple: src pixels per dst pixel along the dst x and y axis
+    """
+    if isinstance(index, np.ndarray):
+        row = index[index.shape[0]//2]
+        col = index[:, index.shape[1]//2]
+    else:
+        row = index_to_numpy(index.crop(0, index.height//2, index.width, 1))[0]
+        col = index_to_numpy(index.crop(index.width//2, 0, 1, index.height))[:, 0]
+
+    def step(line):
+        line = line.astype(np.float64)
+        valid = (line[:, 0] < xSize) & (line[:, 1] < ySize)
+        diff = np.diff(line, axis=0)[valid[1:] & valid[:-1]]
+        return float(np.median(np.hypot(diff[:, 0], diff[:, 1]))) if len(diff) else 1.0
+
+    return step(row), step(col)
+
+
+def shrink_factor(srcScale, wfac, hfac):
+    """Integer shrink of a src file scaled by ``wfac``/``hfac`` against the index src size"""
+    shrink = int(min(srcScale[0] * wfac, srcScale[1] * hfac))
+    return shrink if shrink > 1 else 1
+
+
+def shrink_on_load(name, image, shrink):
+    """Load a src file shrunk by about ``shrink``
+
+    JPEG files are shrunk while decoding, for (pyramidal) TIFF files the smallest page
+    that is still large enough is loaded. Only pages smaller than the full-resolution image
+    with its aspect ratio (the reduced-resolution levels of a pyramid) are candidates; other
+    pages are different images. What is left of the shrink is done with ``vips shrink``.
+    """
+    import pyvips
+
+    _logger.info(f'Shrinking on load: {shrink}')
+    loader = image.get('vips-loader') if image.get_typeof('vips-loader') else ''
+    level = image
+
+    if loader.startswith('jpegload'):
+        level = pyvips.Image.new_from_file(name, shrink=max(f for f in (1, 2, 4, 8) if f <= shrink))
+    elif loader.startswith('tiffload') and image.get_typeof('n-pages'):
+        for page in range(1, image.get('n-pages')):
+            candidate = pyvips.Image.new_from_file(name, page=page)
+            smaller = candidate.width < level.width and candidate.height < level.height
+            large_enough = candidate.width * shrink >= image.width and candidate.height * shrink >= image.height
+            # a reduced-resolution level keeps the aspect ratio (up to rounding of its size)
+            reduced = abs(candidate.width * image.height - candidate.height * image.width) <= image.width + image.height
+            if (smaller and large_enough and reduced
+                    and candidate.bands == image.bands and candidate.format == image.format):
+                level = candidate
+
+    # what is left of the shrink after loading
+    hshrink = max(level.width * shrink // image.width, 1)
+    vshrink = max(level.height * shrink // image.height, 1)
+    if hshrink > 1 or vshrink > 1:
+        level = level.shrink(hshrink, vshrink)
+    return level
+
+
+ENGINES = {
+    'vips': warp_vips,
+    'numpy': warp_numpy,
+}
+
+
+def select_engine(name, interpolation, calibration=None):
+    """Pick the engine for a single file (``--engine auto``)
+
+    Small files are warped faster in-process with numpy, large ones (which do not
+    fit the numpy engine's in-memory approach) with vips. The crossover depends on the
+    band count and data type of the src (see :data:`NUMPY_MAX_PIXELS`).
+
+    Args:
+      calibration (dict): crossover per ``(bands, dtype)`` (see :func:`read_engine_calibration`)
+    """
+    if load_pyvips() is None:
+        return 'numpy'
+    if interpolation not in NUMPY_INTERPOLATIONS:
+        return 'vips'
+
+    dataset = gdal.Open(name, gdal.GA_ReadOnly)
+    bands = dataset.RasterCount
+    dtype = NUMPY_DTYPES.get(dataset.GetRasterBand(1).DataType)
+    pixels = dataset.RasterXSize * dataset.RasterYSize
+    return 'numpy' if pixels <= numpy_max_pixels(bands, dtype, calibration) else 'vips'
+
+
+def numpy_max_pixels(bands, dtype, calibration=None):
+    """Largest src in pixels for which numpy is picked (the nearest calibrated band count is used)"""
+    table = dict(NUMPY_MAX_PIXELS)
+    table.update(calibration or {})
+    candidates = [key for key in table if key[1] == dtype]
+    if not candidates:
+        # uncalibrated data type: same bytes as the defaults
+        itemsize = np.dtype(dtype).itemsize if dtype else 8
+        return NUMPY_MAX_BYTES // (bands * itemsize)
+    key = min(candidates, key=lambda key: (abs(key[0] - bands), key[0]))
+    # scale by the band count if it differs from the calibrated one
+    return table[key] * key[0] // bands
+
+
+def read_engine_calibration(path):
+    """Derive the engine crossover from the CSV of the engine benchmark (``tests/bench.bat``)
+
+    The CSV is the hyperfine export with the parameters ``e`` (engine), ``s`` (src width
+    and height), ``b`` (bands) and ``t`` (data type). For every band count and data type the
+    crossover is the largest src size for which numpy was faster than vips.
+
+    Returns:
+      dict: src pixels per ``(bands, dtype)``
+    """
+    import csv
+
+    means = {}
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            key = (int(row['parameter_b']), row['parameter_t'])
+            size = int(row['parameter_s'])
+            means.setdefault(key, {}).setdefault(size, {})[row['parameter_e']] = float(row['mean'])
+
+    calibration = {}
+    for key, sizes in means.items():
+        faster = [size for size, engines in sizes.items()
+                  if 'numpy' in engines and 'vips' in engines and engines['numpy'] <= engines['vips']]
+        calibration[key] = max(faster) ** 2 if faster else 0
+    return calibration
+
+
+def load_pyvips():
+    """Import pyvips (``None`` if pyvips or libvips is not available)"""
+    try:
+        import pyvips
+    except (ImportError, OSError):
+        return None
+    return pyvips
+
+
+def index_to_numpy(index):
+    """Return the index as a numpy array of shape ``(height, width, 2)``"""
+    if isinstance(index, np.ndarray):
+        return index
+    if index.filename and index.filename.endswith('.v'):
+        # share the pages of the memory-mapped file instead of copying them
+        return read_vips_file(index.filename)
+    return np.ndarray(buffer=index.write_to_memory(), shape=[index.height, index.width, index.bands],
+                      dtype=VIPS_NUMPY_TYPES[index.format])
+
+
+def index_to_vips(index):
+    """Return the index as a vips image"""
+    if not isinstance(index, np.ndarray):
+        return index
+    import pyvips
+
+    height, width, bands = index.shape
+    index = np.ascontiguousarray(index)
+    return pyvips.Image.new_from_memory(index.data, width, height, bands, NUMPY_VIPS_TYPES[index.dtype.name])
+
+
+def shard_files(src_names, shard, count):
+    """The src files of shard ``shard`` (1-based) of ``count`` shards
+
+    The files are spread by size (largest first, each to the shard with the least
+    bytes so far), so the shards are balanced and every node gets the same partitioning.
+    """
+    shards = [[] for _ in range(count)]
+    loads = [0] * count
+    for size, name in sorted(((os.path.getsize(name), name) for name in src_names), key=lambda s: (-s[0], s[1])):
+        i = loads.index(min(loads))
+        shards[i].append(name)
+        loads[i] += size
+    return sorted(shards[shard - 1])
+
+
+def acquire_index_lock(path, key=None):
+    """Try to become the process building the index file ``path``
+
+    An existing index built with other parameters than ``key`` (see :func:`index_digest`)
+    is stale; it is removed and rebuilt by the process acquiring the lock.
+
+    Returns:
+      bool: ``True`` if the lock was acquired and the index has to be built,
+      ``False`` if the index exists (after waiting for the process holding the lock)
+    """
+    lock = path + '.lock'
+    dst_folder = os.path.dirname(path)
+    if dst_folder and not os.path.exists(dst_folder):
+        os.makedirs(dst_folder, exist_ok=True)
+
+    def current():
+        return os.path.exists(path) and (key is None or read_index_metadata(path).get('IndexKey') == key)
+
+    start = time.monotonic()
+    while not current():
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            if time.monotonic() - start > SHARD_LOCK_TIMEOUT:
+                raise TimeoutError(f'Waiting for the index {path} timed out (remove {lock} if it is stale)')
+            time.sleep(SHARD_LOCK_POLL)
+            continue
+        if current():
+            # built by another process in the meantime
+            os.remove(lock)
+            return False
+        if os.path.exists(path):
+            _logger.warning(f'Rebuilding index {path}: it was built with other parameters')
+            os.remove(path)
+            if os.path.exists(path + SIDECAR_EXT):
+                os.remove(path + SIDECAR_EXT)
+        return True
+    return False
+
+
+def release_index_lock(path):
+    os.remove(path + '.lock')
+
+
+def write_summary(path, summary):
+    """Write a run summary (src files and their outputs) as JSON"""
+    _logger.info(f'Writing summary: {path}')
+    dst_folder = os.path.dirname(path)
+    if dst_folder and not os.path.exists(dst_folder):
+        os.makedirs(dst_folder)
+    with open(path, 'w') as file:
+        json.dump(summary, file, indent=2)
+
+
+def merge_shards(paths):
+    """Merge the summaries of sharded runs and check them for completeness
+
+    Args:
+      paths (List[str]): the summary files (see ``--summary``)
+
+    Returns:
+      dict: the merged summary; ``problems`` lists everything incomplete or inconsistent
+    """
+    summaries = []
+    for path in paths:
+        with open(path) as file:
+            summaries.append(json.load(file))
+
+    problems = []
+    files = {}
+    shards = {}
+    for path, summary in zip(paths, summaries):
+        if summary['src'] != summaries[0]['src'] or summary['src_count'] != summaries[0]['src_count']:
+            problems.append(f'{path}: src differs from {paths[0]}')
+        shard = summary['shard'] or [1, 1]
+        if shard[1] != (summaries[0]['shard'] or [1, 1])[1]:
+            problems.append(f'{path}: shard count differs from {paths[0]}')
+        if shard[0] in shards:
+            problems.append(f'{path}: shard {shard[0]} is also in {shards[shard[0]]}')
+        shards[shard[0]] = path
+        for name, result in summary['files'].items():
+            if name in files:
+                problems.append(f'{path}: {name} is in more than one shard')
+            files[name] = result
+
+    count = (summaries[0]['shard'] or [1, 1])[1] if summaries else 0
+    for shard in range(1, count + 1):
+        if shard not in shards:
+            problems.append(f'shard {shard}/{count} is missing')
+
+    src_count = summaries[0]['src_count'] if summaries else 0
+    if len(files) != src_count:
+        problems.append(f'{len(files)} of {src_count} src files were processed')
+
+    return {
+        'src': summaries[0]['src'] if summaries else None,
+        'shards': count,
+        'src_count': src_count,
+        'files': files,
+        'problems': problems,
+    }
+
+
+def src_grid(args, src_names, srcNodataDic, verbose=True):
+    """Size, projection and geotransform of the largest src file (the grid of the index)
+
+    Also collects the nodata values of the src files into ``srcNodataDic``
+    (and prints the src names if ``verbose``).
+
+    Returns:
+      tuple: the src size, projection and geotransform
+      (``None`` if the src is missing a projection and/or geotransform)
+    """
+    # gdal read files; get max size and projection/geotransform
+
+    xSize = ySize = -1
 
-    # START LOOP on src files
     for name in src_names:
-        name_split = os.path.splitext(os.path.basename(name))
-        
-        if not dst_folder:
-            dst_folder = os.path.dirname(name)
+        if verbose:
+            print(name)
+        dataset = gdal.Open(name, gdal.GA_ReadOnly)
+        if (dataset.RasterXSize > xSize or dataset.RasterYSize > ySize ):
+            xSize = dataset.RasterXSize
+            ySize = dataset.RasterYSize
+            projection   = dataset.GetProjection()
+            geotransform = dataset.GetGeoTransform()
+        if srcNodataDic is not None:
+            srcNodataDic[name] = dataset.GetRasterBand(1).GetNoDataValue()
+
+    if args.vs:
+        xSize = args.vs[0]
+        ySize = args.vs[1]
+
+    if projection == '' or geotransform == (0.0, 1.0, 0.0, 0.0, 0.0, 1.0):
+        if verbose:
+            print('src is missing a projection and/or geotransform')
+        return
+
+    return xSize, ySize, projection, geotransform
+
+
+def load_index(args, vii, src_names, srcNodataDic, indexCache=None, grid=None):
+    """Create the index for the src files (or read it from ``vii``)
+
+    Also collects the nodata values of the src files into ``srcNodataDic``.
+
+    Args:
+      grid (tuple): the src grid if already read (see :func:`src_grid`)
+
+    Returns:
+      tuple: the index, its projection and geotransform and the src size
+      (``None`` if the src is missing a projection and/or geotransform)
+    """
+    if vii == None:
+        if grid is None:
+            grid = src_grid(args, src_names, srcNodataDic)
+            if grid is None:
+                return
+        xSize, ySize, projection, geotransform = grid
+
+        key = index_key(args, xSize, ySize, projection, geotransform)
+        if indexCache is not None and key in indexCache:
+            _logger.info(f'Reusing index: {xSize}x{ySize}')
+            index, projection, geotransform = indexCache[key]
+        else:
+            index, projection, geotransform = create_index(args, xSize, ySize, projection, geotransform)
+            if indexCache is not None:
+                indexCache[key] = (index, projection, geotransform)
+
+        # write the index file (to a temporary file first, so it is never read half-written)
+        if args.vio:
+            _logger.info(f'Writing index: {args.vio}')
+            dst_folder = os.path.dirname(args.vio)
+            if dst_folder and not os.path.exists(dst_folder):
+                os.makedirs(dst_folder)
+            root, ext = os.path.splitext(args.vio)
+            tmp = f'{root}.{os.getpid()}.tmp{ext}'
+            write_to_file(index, tmp, args.co, projection, geotransform,{'SrcXSize':str(xSize),'SrcYSize':str(ySize),'IndexKey':index_digest(key)})
+            if os.path.exists(tmp + SIDECAR_EXT):
+                os.replace(tmp + SIDECAR_EXT, args.vio + SIDECAR_EXT)
+            os.replace(tmp, args.vio)
+
+    else: #vii != None
+        key = ('vii', os.path.abspath(vii), tuple(args.vs) if args.vs else None)
+        if indexCache is not None and key in indexCache:
+            _logger.info(f'Reusing index: {vii}')
+            index, projection, geotransform, xSize, ySize = indexCache[key]
+        else:
+            index, projection, geotransform, xSize, ySize = read_index(vii, args.vs)
+            if indexCache is not None:
+                indexCache[key] = (index, projection, geotransform, xSize, ySize)
+
+        if srcNodataDic is not None:
+            for name in src_names:
+                dataset = gdal.Open(name, gdal.GA_ReadOnly)
+                srcNodataDic[name] = dataset.GetRasterBand(1).GetNoDataValue()
+
+    return index, projection, geotransform, xSize, ySize
+
+
+def index_key(args, xSize, ySize, projection, geotransform):
+    """Key identifying an index by its source grid and warp parameters"""
+    return (xSize, ySize, projection, tuple(geotransform),
+            tuple(args.outputBounds) if args.outputBounds else None, args.outputBoundsSRS,
+            tuple(args.xyRes) if args.xyRes else None, args.targetAlignedPixels,
+            tuple(args.widthHeight) if args.widthHeight else None,
+            args.srcSRS, args.dstSRS, args.resampleAlg)
+
+
+def index_digest(key):
+    """Digest of an index key, stored in the metadata of index files (``IndexKey``)"""
+    return hashlib.sha1(json.dumps(key).encode()).hexdigest()
+
+
+def read_index_metadata(path):
+    """Metadata of the index file ``path`` (from its sidecar file for ``.v`` indexes)"""
+    if path.endswith('.v'):
+        try:
+            return read_sidecar(path)['metadata'] or {}
+        except FileNotFoundError:
+            return {}
+    dataset = gdal.Open(path, gdal.GA_ReadOnly)
+    return dataset.GetMetadata() if dataset is not None else {}
+
+
+def create_index(args, xSize, ySize, projection, geotransform):
+    """Create a vips index of the src grid and warp it with gdal
+
+    Returns:
+      tuple: the warped index with its new projection and geotransform
+    """
+    pyvips = load_pyvips()
+
+    # select proper types and interpolation methods for GDAL, Numpy & VIPS
+    maxUInt16 = np.iinfo(np.uint16).max
+    maxFloat32 = np.finfo(np.float32).max
+    ltMaxUInt16 = (xSize < maxUInt16 and ySize < maxUInt16)
+
+    maxUInt = maxUInt16 if ltMaxUInt16 else 2**32-1
+
+    np_index_type = 'uint16' if ltMaxUInt16 else 'uint32'
+    gdal_index_type = gdal.GDT_UInt16 if ltMaxUInt16 else gdal.GDT_UInt32
+    gdal_index_warp_type = gdal.GDT_Float32
+    dstNodataMax = maxFloat32
+    vips_index_type = 'float'
+
+    if args.resampleAlg == 'near' or args.resampleAlg == None:
+        gdal_index_warp_type = gdal_index_type
+        dstNodataMax = maxUInt16
+        vips_index_type = 'ushort' if ltMaxUInt16 else 'uint'
         
-        if not dst_name or src_multi:
-            dst_name = name_split[0]
+
+    # create vips index
+    _logger.info(f'Creating index: {xSize}x{ySize} type:{vips_index_type}')
+    
+    if pyvips is not None:
+        index = pyvips.Image.xyz(xSize, ySize)
         
-        if not dst_ext:
-            dst_ext = name_split[1] 
+        if ltMaxUInt16:
+            index = index.cast('ushort')
             
-        output = f'{dst_folder}/{dst_name}{dst_suffix}{dst_ext}'
-        
-        if os.path.exists(output) and not args.overwrite:
-            _logger.warning(f'Output dataset {output} exists,\ndelete the file or use -overwrite and run again')
-            continue
+         # vips2np
+        np_index = np.ndarray(buffer=index.write_to_memory(), shape=[ySize, xSize, 2], dtype=np_index_type)
+    else:
+        np_index = np.moveaxis(np.indices((ySize, xSize), dtype=np_index_type)[::-1], 0, -1)
 
-        _logger.info(f'Reading file: {name}')
-        image = pyvips.Image.new_from_file(name)
+    # np2gdal
+    gdal_index = gdal.GetDriverByName('MEM').Create('', xSize, ySize, 2, gdal_index_type)
 
-        if (image.width == xSize and image.height == ySize ):
-            idx = index 
-        else:
-            wfac = image.width/xSize
-            hfac = image.height/ySize
-            idx = index * [wfac, hfac]
+    gdal_index.GetRasterBand(1).WriteArray(np_index[:, :, 0])
+    gdal_index.GetRasterBand(2).WriteArray(np_index[:, :, 1])
 
-        noData = None
-        flattenAlpha = False
+    # slower
+    # band1.WriteArray(np.tile(np.linspace(0, xSize, xSize, dtype= np_index_type,endpoint=False), (ySize, 1)))
+    # band2.WriteArray(np.tile(np.linspace(0, ySize, ySize, dtype= np_index_type,endpoint=False).reshape((-1, 1)), (1, xSize)))
 
-        if args.srcNodata is not None:
-            srcNodata = args.srcNodata
+    # gdal set metadata
+    
+    gdal_index.SetProjection( projection )
+    gdal_index.SetGeoTransform( geotransform )
+
+    gdal_resample = {
+        'near': gdal.GRA_NearestNeighbour,
+        'bilinear': gdal.GRA_Bilinear,
+        'cubic': gdal.GRA_Cubic,
+        'cubicspline': gdal.GRA_CubicSpline,
+        'lanczos': gdal.GRA_CubicSpline,
+    }[args.resampleAlg]
+
+    _logger.info('Warping index')
+    # gdal warp
+    gdal_index = gdal.Warp('', gdal_index,
+                                format='MEM',
+                                outputType = gdal_index_warp_type,
+                                resampleAlg = gdal_resample,
+                                #srcNodata = maxUInt,
+                                dstNodata = dstNodataMax,
+                                outputBounds = args.outputBounds,
+                                outputBoundsSRS = args.outputBoundsSRS,
+                                xRes = args.xyRes[0] if args.xyRes != None else None,
+                                yRes = args.xyRes[1] if args.xyRes != None else None,
+                                targetAlignedPixels = args.targetAlignedPixels,
+                                width = args.widthHeight[0] if args.widthHeight != None else None,
+                                height = args.widthHeight[1] if args.widthHeight != None else None,
+                                srcSRS = args.srcSRS,
+                                dstSRS = args.dstSRS,
+                                multithread = args.multithread)
+
+
+    # gdal read new metadata
+    projection   = gdal_index.GetProjection()
+    geotransform = gdal_index.GetGeoTransform()
+
+    # gdal2np
+    band1 = gdal_index.GetRasterBand(1)
+    band2 = gdal_index.GetRasterBand(2)
+
+    band1 = band1.ReadAsArray()
+    band2 = band2.ReadAsArray()
+    
+    np_index = np.moveaxis(np.array([band1,band2]), 0, -1)
+
+    if pyvips is None:
+        return np_index, projection, geotransform
+
+    height, width, bands = np_index.shape
+    np_index = np_index.reshape(width * height * bands)
+
+    # np2vips
+    index = pyvips.Image.new_from_memory(np_index.data, width, height, bands, vips_index_type)
+
+    return index, projection, geotransform
+
+
+def read_index(vii, vs=None):
+    """Open the index file ``vii`` (the src size is read from its metadata unless ``vs`` is set)
+
+    Indexes in the vips format (``.v``) are memory-mapped, so concurrent processes
+    share the same pages; their geoinformation is read from the sidecar file.
+
+    Returns:
+      tuple: the index, its projection and geotransform and the src size
+    """
+    pyvips = load_pyvips()
+
+    _logger.info(f'Reading index: {vii}')
+    if vii.endswith('.v'):
+        sidecar = read_sidecar(vii)
+        projection   = sidecar['projection']
+        geotransform = tuple(sidecar['geotransform'])
+        metadata = sidecar['metadata'] or {}
+        index = pyvips.Image.new_from_file(vii) if pyvips is not None else read_vips_file(vii)
+    else:
+        index = gdal.Open(vii, gdal.GA_ReadOnly)
+        projection   = index.GetProjection()
+        geotransform = index.GetGeoTransform()
+        metadata = index.GetMetadata()
+        if pyvips is not None:
+            index = pyvips.Image.new_from_file(vii)
         else:
-            srcNodata = [srcNodataDic[name]] if srcNodataDic[name] is not None else None
+            index = np.moveaxis(index.ReadAsArray(), 0, -1)
+
+    if projection == '' or geotransform == (0.0, 1.0, 0.0, 0.0, 0.0, 1.0):
+        _logger.warning('The index is missing a projection and/or geotransform')
 
-        if srcNodata is not None:
-            srcNodataSingle = len(srcNodata) == 1
-            noData = srcNodata[0] if srcNodataSingle else 0
-            #if image.hasalpha():
-            #    image = image[0:image.bands -1]
-            if srcNodataSingle:
-                alpha = (image != srcNodata).bandor()
+    if vs:
+        xSize = vs[0]
+        ySize = vs[1]
+    else:
+        xSize = int(metadata["SrcXSize"])
+        ySize = int(metadata["SrcYSize"])
+
+    return index, projection, geotransform, xSize, ySize
+
+
+def read_vips_file(path):
+    """Memory-map a file in the vips format (``.v``) as numpy array of shape ``(height, width, bands)``"""
+    with open(path, 'rb') as file:
+        header = file.read(VIPS_HEADER_SIZE)
+
+    # the magic number is always stored MSB first; all other fields in the byte order of the writer
+    order = {VIPS_MAGIC_INTEL: '<', VIPS_MAGIC_SPARC: '>'}.get(header[:4])
+    if order is None or len(header) < VIPS_HEADER_SIZE:
+        raise ValueError(f'{path} is not a vips file')
+    width, height, bands, _, bandFmt, coding = struct.unpack(order + '6i', header[4:28])
+    if coding != 0 or VIPS_BAND_FORMATS[bandFmt] not in VIPS_NUMPY_TYPES:
+        raise ValueError(f'{path}: unsupported vips coding or band format')
+
+    dtype = np.dtype(VIPS_NUMPY_TYPES[VIPS_BAND_FORMATS[bandFmt]]).newbyteorder(order)
+    return np.memmap(path, dtype=dtype, mode='r', offset=VIPS_HEADER_SIZE, shape=(height, width, bands))
+
+
+def write_vips_file(array, path):
+    """Write a numpy array of shape ``(height, width, bands)`` in the vips format (``.v``)"""
+    height, width, bands = array.shape
+    array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+    header = VIPS_MAGIC_INTEL + struct.pack('<7i2fi2h2i',
+        width, height, bands, array.dtype.itemsize * 8, VIPS_BAND_FORMATS.index(NUMPY_VIPS_TYPES[array.dtype.name]),
+        0, 0, 1.0, 1.0, 0, 0, 0, 0, 0)
+    with open(path, 'wb') as file:
+        file.write(header.ljust(VIPS_HEADER_SIZE, b'\0'))
+        array.tofile(file)
+
+
+def read_sidecar(path):
+    """Read the geoinformation of ``path`` from its sidecar file"""
+    with open(path + SIDECAR_EXT) as file:
+        return json.load(file)
+
+
+def write_sidecar(path, projection, geotransform, metadata = None, noData = None):
+    """Write the geoinformation of ``path`` to its sidecar file"""
+    with open(path + SIDECAR_EXT, 'w') as file:
+        json.dump({
+            'projection': projection,
+            'geotransform': list(geotransform),
+            'metadata': metadata,
+            'nodata': noData,
+        }, file, indent=2)
+
+
+def gwarp_batch(jobs, indexCache=None):
+    """Run many warp jobs in one process, sharing indexes between them
+
+    Jobs with the same source grid and warp parameters (or the same ``--vii``
+    index file) reuse the index created by the first of them. An index is dropped
+    after the last job using it, so only the indexes of upcoming jobs are kept
+    (those of mosaic jobs are dropped right after the job).
+
+    The outputs of all jobs with dst ``-`` are streamed to stdout as a single tar;
+    everything else printed by the jobs goes to stderr then.
+
+    Args:
+      jobs (List[argparse.Namespace]): parsed options of each job (see :func:`parse_args`)
+      indexCache (dict): the cache of the indexes (see :func:`gwarp`)
+
+    Returns:
+      dict: summary of the run
+    """
+    indexCache = {} if indexCache is None else indexCache
+    keys = [job_index_key(args) for args in jobs]
+    created = set()
+    summary = {'jobs': len(jobs), 'succeeded': 0, 'failed': 0, 'outputs': 0, 'indexes': 0}
+    start = time.perf_counter()
+
+    tar = None
+    if batch_streams(jobs):
+        tar = tarfile.open(fileobj=sys.stdout.buffer, mode='w|')
+        for args in jobs:
+            if args.dst == '-':
+                args.dst = tar
+
+    with contextlib.redirect_stdout(sys.stderr) if tar is not None else contextlib.nullcontext():
+        for i, args in enumerate(jobs, start=1):
+            _logger.info(f'Running job {i}/{len(jobs)}: {args.src}')
+            try:
+                outputs = gwarp(args, indexCache)
+            except Exception as e:
+                _logger.exception(f'Job {i} ({args.src}) failed: {e}')
+                outputs = None
+
+            if outputs is None:
+                summary['failed'] += 1
             else:
-                alpha = image[0] != srcNodata[0]
-                for i, srcNodata in enumerate(srcNodata[1:], start=1):
-                    alpha = alpha and (image[i] != srcNodata)
-                    
-            if noData != 0:
-                flattenAlpha = image.bands
-                image = image.bandjoin(alpha)
-        if args.dstNodata is not None:
-            noData = args.dstNodata
-            if srcNodata is None:
-                if  noData != 0 and flattenAlpha == False:
-                    flattenAlpha = image.bands
-                    image = image.addalpha()
-
-
-        _logger.info(f'Warping file: {name}')
-        image = image.mapim( idx, interpolate=interp)
-        
-        if flattenAlpha:
-            idx_mask = idx_mask if idx_mask is not None else (idx > [image.width, image.height]).bandor()
-            image =  idx_mask.ifthenelse(noData,image.flatten(background=noData))
+                summary['succeeded'] += 1
+                summary['outputs'] += len(outputs)
+
+            # drop the indexes no upcoming job uses
+            created.update(indexCache)
+            upcoming = set(keys[i:])
+            for key in [key for key in indexCache if key not in upcoming]:
+                del indexCache[key]
+
+    if tar is not None:
+        tar.close()
+        sys.stdout.buffer.flush()
 
-        write_to_file(image, output, args.co, projection, geotransform, noData=noData)
+    summary['indexes'] = len(created)
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
 
 
+def job_index_key(args):
+    """Key of the index a job will use (see :func:`index_key`)
+
+    Returns:
+      tuple: the key (``None`` for mosaic jobs, which use an index per src file,
+      and jobs whose src cannot be read)
+    """
+    if args.mosaic:
+        return None
+    if args.vii:
+        return ('vii', os.path.abspath(args.vii), tuple(args.vs) if args.vs else None)
+    src_names = glob.glob(args.src, recursive=True)
+    if not src_names:
+        return None
+    try:
+        grid = src_grid(args, src_names, None, verbose=False)
+    except Exception:
+        return None
+    return index_key(args, *grid) if grid is not None else None
+
+
+def batch_streams(jobs):
+    """Whether any job of a batch run streams its outputs to stdout (dst ``-``)"""
+    return any(args.dst == '-' for args in jobs)
+
+
+def add_to_tar(tar, output, data):
+    """Add the file ``data`` named like ``output`` to a streamed tar"""
+    info = tarfile.TarInfo(os.path.basename(output))
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def read_jobs(path):
+    """Read a job manifest with one job per line
+
+    Each line holds the CLI arguments of a job, either as a JSON array of strings
+    (``["-t_srs", "EPSG:3857", "in/*.tif", "out/"]``) or as a JSON string
+    with a command line (``"-t_srs EPSG:3857 in/*.tif out/"``). Empty lines are skipped.
+
+    Args:
+      path (str): path to the manifest (``-`` for stdin)
+
+    Returns:
+      List[argparse.Namespace]: parsed options of each job
+    """
+    jobs = []
+    file = sys.stdin if path == '-' else open(path)
+    try:
+        for n, line in enumerate(file, start=1):
+            line = line.strip()
+            if line == '':
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f'{path}:{n}: invalid JSON ({e})')
+            if isinstance(job, str):
+                job = shlex.split(job)
+            if not isinstance(job, list):
+                raise ValueError(f'{path}:{n}: a job has to be a list of arguments or a command line')
+            try:
+                jobs.append(parse_args([str(arg) for arg in job]))
+            except SystemExit:
+                # argparse already printed the reason to stderr
+                raise ValueError(f'{path}:{n}: invalid gwarp arguments: {" ".join(map(str, job))}')
+    finally:
+        if file is not sys.stdin:
+            file.close()
+    return jobs
+
 
 def write_to_file(image, dst, co, projection, geotransform, metadata = None, noData = None ):
+    if dst.endswith('.v'):
+        # uncompressed vips format (memory-mapped when read); the geoinformation goes to a sidecar file
+        _logger.info(f'Writing file: {dst}')
+        if isinstance(image, np.ndarray):
+            write_vips_file(image, dst)
+        else:
+            image.write_to_file(dst)
+        write_sidecar(dst, projection, geotransform, metadata, noData)
+        return
+
+    if isinstance(image, np.ndarray):
+        write_array_to_file(image, dst, co, projection, geotransform, metadata, noData)
+        return
+
     _logger.info(f'Writing file: {dst}')
     image.write_to_file(dst, **co)
+    set_geoinformation(dst, projection, geotransform, metadata, noData)
+
+
+def write_to_buffer(image, suffix, co, projection, geotransform, metadata = None, noData = None ):
+    """Encode an image (vips image or numpy array) in the format of ``suffix`` (e.g. '.tif')
+
+    The file is assembled in gdal's in-memory file system, so GeoTIFFs carry their
+    geoinformation without touching the disk.
+
+    Returns:
+      bytes: the encoded file
+    """
+    if suffix == '.v':
+        raise ValueError('The vips format (.v) can only be written to files')
 
+    path = f'/vsimem/gwarp_{os.getpid()}_{id(image)}{suffix}'
+    if isinstance(image, np.ndarray):
+        write_array_to_file(image, path, co, projection, geotransform, metadata, noData)
+    else:
+        gdal.FileFromMemBuffer(path, image.write_to_buffer(suffix, **co))
+        set_geoinformation(path, projection, geotransform, metadata, noData)
+
+    file = gdal.VSIFOpenL(path, 'rb')
+    gdal.VSIFSeekL(file, 0, 2)
+    size = gdal.VSIFTellL(file)
+    gdal.VSIFSeekL(file, 0, 0)
+    data = gdal.VSIFReadL(1, size, file)
+    gdal.VSIFCloseL(file)
+    gdal.Unlink(path)
+    return data
+
+
+def set_geoinformation(dst, projection, geotransform, metadata = None, noData = None ):
+    """Add projection, geotransform, metadata and nodata to a GeoTIFF written by vips"""
     if dst.endswith(('.tif','.tiff')):
         # write metadata
         dataset = gdal.Open( dst, gdal.GA_Update )
@@ -310,12 +1499,78 @@ def write_to_file(image, dst, co, projection, geotransform, metadata = None, noD
 
         if noData is not None:
             band = dataset.GetRasterBand(1)
-            band.SetNoDataValue(noData)
+            band.SetNoDataValue(nodata_tag(noData))
             band.FlushCache()
         
     else:
         _logger.warning(f'WARNING: {dst} has no geoinformation. Consider using GeoTIFF as output format.')
 
+def write_array_to_file(array, dst, co, projection, geotransform, metadata = None, noData = None ):
+    """Write a numpy array of shape ``(height, width, bands)`` with gdal
+
+    The output format is derived from the file extension and the vips create options
+    are translated to gdal creation options (see :func:`gdal_creation_options`).
+    """
+    _logger.info(f'Writing file: {dst}')
+    height, width, bands = array.shape
+    dataset = gdal.GetDriverByName('MEM').Create('', width, height, bands, NUMPY_GDAL_TYPES[array.dtype.name])
+    if noData is not None:
+        noData = nodata_tag(noData)
+    for i in range(bands):
+        band = dataset.GetRasterBand(i + 1)
+        band.WriteArray(array[:, :, i])
+        if noData is not None:
+            band.SetNoDataValue(noData)
+
+    dataset.SetProjection( projection )
+    dataset.SetGeoTransform( geotransform )
+
+    if metadata is not None:
+        dataset.SetMetadata( metadata )
+
+    gdal.Translate(dst, dataset, creationOptions=gdal_creation_options(co))
+
+
+def gdal_creation_options(co):
+    """Translate vips create options (e.g. ``{'compression': 'lzw'}``) to gdal creation options"""
+    options = []
+    for key, value in co.items():
+        if key == 'compression':
+            options.append(f'COMPRESS={str(value).upper()}')
+            if value in ('lzw', 'deflate') and 'predictor' not in co:
+                # vips defaults to the horizontal predictor, gdal to none
+                options.append('PREDICTOR=2')
+        elif key == 'predictor':
+            options.append(f'PREDICTOR={ {"none": 1, "horizontal": 2, "float": 3}.get(value, value) }')
+        elif key == 'tile':
+            options.append(f'TILED={"YES" if value else "NO"}')
+        elif key == 'tile_width':
+            options.append(f'BLOCKXSIZE={value}')
+        elif key == 'tile_height':
+            options.append(f'BLOCKYSIZE={value}')
+        elif key == 'bigtiff':
+            options.append(f'BIGTIFF={"YES" if value else "NO"}')
+        elif key == 'q':
+            options.append(f'JPEG_QUALITY={value}')
+        elif key == 'level':
+            compression = str(co.get('compression', '')).upper()
+            options.append(f'{compression}_LEVEL={value}' if compression in ('ZSTD', 'WEBP') else f'ZLEVEL={value}')
+        else:
+            options.append(f'{key.upper()}={value}')
+    return options
+
+
+def parse_shard(shard):
+    """Parse ``i/N`` into ``[i, N]`` (``1 <= i <= N``)"""
+    try:
+        i, n = map(int, shard.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{shard}' (expected i/N)")
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"invalid shard '{shard}' (i has to be between 1 and N)")
+    return [i, n]
+
+
 def parse_nif(nif):
     if nif == 'None':
         return None
@@ -359,6 +1614,57 @@ Additional info on resampling and interpolation methods
         nohalo      : edge sharpening resampler with halo reduction
         vsqbs       : B-Splines with antialiasing smoothing
 
+--vio <dstindex>, --vii <srcindex>:
+    Index files are usually GeoTIFFs. With the extension '.v' the index is written
+    uncompressed in the vips format and its geoinformation to '<dstindex>.json'.
+    Such an index is memory-mapped when read with --vii: it is available instantly
+    and many concurrent gwarp processes share the same memory.
+
+dstfile:
+    With '-' the output is written to stdout instead of a file (a tar archive if the src
+    pattern matches several files). The format is taken from -of or the src extension;
+    GeoTIFFs keep their geoinformation. From Python, any binary file-like object
+    (e.g. io.BytesIO) can be passed as 'dst'.
+
+--engine <engine>:
+    The engine applying the index to the src files:
+
+        vips        : vips mapim (default; falls back to numpy if vips is not available)
+        numpy       : blocked, multithreaded numpy gather (nearest and bilinear only);
+                      reads and writes with gdal and keeps the whole src in memory
+        auto        : numpy for small src files, vips for large ones (picked per file
+                      from size, band count and data type)
+
+    The crossover of 'auto' is not calibrated by default. Run the engine crossover
+    benchmark of tests/bench.bat and pass its CSV with --engine-calibration <csv>.
+
+--shrink <mode>:
+    If the output is much smaller than the src (e.g. with -ts or -tr), the src is read
+    from a pre-shrunk level (JPEG shrink-on-load, TIFF pyramid pages or gdal overviews) or
+    shrunk before the index is applied. This cuts decoding and reduces aliasing.
+
+        auto        : shrink for all interpolations but 'nearest' (default)
+        on          : shrink for all interpolations (output of 'near' will differ from gdalwarp)
+        off         : never shrink
+
+    Files with src nodata values are never shrunk.
+
+--shard <i/N>:
+    Split the src files deterministically into N shards of about the same size in bytes
+    and warp only the i-th (1-based). All shards build the same index from all src files.
+    With --vio the index is built only once: the first shard takes a lock ('<dstindex>.lock')
+    and writes the index, the others wait for it and read it (an existing index file is reused).
+    Write a --summary per shard and check the run with:
+
+        gwarp merge-shards [-o merged.json] summary_1.json ... summary_N.json
+
+--mosaic <mode>:
+    Warp all src files (e.g. adjacent scenes) into a single output grid derived from all
+    of them and the warp parameters (-te, -tr, -ts, -t_srs, ...) and write them as one
+    dst file. Where files overlap, the pixel of the first or last file or the brightest pixel
+    (largest sum of its bands) is kept.
+    Pixels equal to the nodata values (-dstnodata, the src nodata or 0) are empty.
+
 -co <create_options>:
     use the parameters of the file save functions of vips. e.g. for TIFF:
 
@@ -401,7 +1707,7 @@ Additional info on resampling and interpolation methods
         const=logging.ERROR,
     )
     parser.add_argument(dest="src", help="the input glob pattern", metavar="srcfile")
-    parser.add_argument(dest="dst", help='the output file or folder', metavar="dstfile", nargs='?')
+    parser.add_argument(dest="dst", help="the output file or folder ('-' for stdout; more info in the epilog)", metavar="dstfile", nargs='?')
     gdal_group = parser.add_argument_group('GDAL')
     gdal_group.add_argument('-te', dest='outputBounds', metavar=("<xmin>", "<ymin>", "<xmax>", "<ymax>"), type=float, nargs=4)
     gdal_group.add_argument('-te_srs', dest='outputBoundsSRS', metavar='<srs_def>')
@@ -412,15 +1718,23 @@ Additional info on resampling and interpolation methods
     gdal_group.add_argument('-t_srs', dest='dstSRS', metavar='<srs_def>')
     gdal_group.add_argument('-multi',  dest='multithread', default=False,  action='store_true')
     gdal_group.add_argument('-srcnodata', dest='srcNodata', metavar='value', nargs='*')
-    gdal_group.add_argument('-dstnodata', dest='dstNodata', metavar='value') # ,nargs='*' GeoTIFF only allows for a single nodata value for all bands
+    gdal_group.add_argument('-dstnodata', dest='dstNodata', metavar='value', help='a single value or one value per band (e.g. "0 0 255"; GeoTIFF only stores the first)')
     gdal_group.add_argument('-r', dest='resampleAlg', default='near', choices=["near","bilinear","cubic","cubicspline","lanczos"],help="resampling method (more info in the epilog)")
+    gdal_group.add_argument('-of', dest='format', choices=list(FORMAT_SUFFIXES), help="output format of outputs without extension (e.g. when streaming to stdout)")
     gdal_group.add_argument('-overwrite', dest='overwrite', default=False, action='store_true')
     gdal_group.add_argument('-co', dest="co", metavar='<NAME=VALUE>*', action='append',  help='create options (more info in the epilog)')
     vips_group = parser.add_argument_group('VIPS')
     vips_group.add_argument('--vips', help='path to the VIPS bin directory (usefull if VIPS is not added to PATH; e.g. on Windows)')
-    vips_group.add_argument('--vio', dest="vio", help='index file output', metavar='dstindex')
+    vips_group.add_argument('--vio', dest="vio", help='index file output (.v for a memory-mapped index; more info in the epilog)', metavar='dstindex')
     vips_group.add_argument('--vii', dest="vii", help='index file input', metavar='srcindex')
     gdal_group.add_argument('--vs', dest="vs", metavar=('<width>', '<height>'), type=int, nargs=2, help='explicitly set src width and height of index')
+    gwarp_group = parser.add_argument_group('gwarp')
+    gwarp_group.add_argument('--mosaic', dest='mosaic', choices=['first', 'last', 'max'], help='warp all src files into a single dst file (more info in the epilog)')
+    gwarp_group.add_argument('--shard', dest='shard', metavar='i/N', type=parse_shard, help='only warp the i-th of N size-balanced shards of the src files (more info in the epilog)')
+    gwarp_group.add_argument('--summary', dest='summary', metavar='<file>', help='write a JSON summary of the src files and their outputs')
+    vips_group.add_argument('--engine', dest='engine', default='vips', choices=['vips', 'numpy', 'auto'], help="engine applying the index (more info in the epilog)")
+    vips_group.add_argument('--engine-calibration', dest='engineCalibration', metavar='<csv>', help="benchmark CSV for '--engine auto' (more info in the epilog)")
+    vips_group.add_argument('--shrink', dest='shrink', default='auto', choices=['auto', 'on', 'off'], help="shrink-on-load of heavily downsampled src files (more info in the epilog)")
     vips_group.add_argument('--vi', dest='v_inter', choices=['nearest', 'bilinear', 'bicubic', 'lbb', 'nohalo', 'vsqbs'], help="interpolation method (more info in the epilog)")
     args = parser.parse_args(args)
 
@@ -428,7 +1742,8 @@ Additional info on resampling and interpolation methods
         args.srcNodata = list(map(parse_nif, tuple(args.srcNodata)))
 
     if args.dstNodata is not None:
-        args.dstNodata = parse_nif(args.dstNodata)
+        args.dstNodata = list(map(parse_nif, args.dstNodata.replace(',', ' ').split()))
+        args.dstNodata = nodata_values(args.dstNodata)
 
     coDict = {}
     if args.co:
@@ -443,16 +1758,64 @@ Additional info on resampling and interpolation methods
     return args
 
 
-def setup_logging(loglevel):
+def parse_batch_args(args):
+    """Parse the command line parameters of ``gwarp batch``
+
+    Args:
+      args (List[str]): command line parameters (without the leading ``batch``)
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(prog="gwarp batch",
+        description="run many gwarp jobs in one process (indexes are shared between jobs)")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO,
+    )
+    parser.add_argument(
+        "-q",
+        "--quite",
+        dest="loglevel",
+        help="set loglevel to ERROR",
+        action="store_const",
+        const=logging.ERROR,
+    )
+    parser.add_argument(dest="jobs", help="the job manifest; one JSON array of gwarp arguments per line ('-' for stdin)", metavar="jobs.jsonl")
+    return parser.parse_args(args)
+
+
+def parse_merge_args(args):
+    """Parse the command line parameters of ``gwarp merge-shards``
+
+    Args:
+      args (List[str]): command line parameters (without the leading ``merge-shards``)
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(prog="gwarp merge-shards",
+        description="merge the summaries of a sharded run and check it for completeness")
+    parser.add_argument('-o', dest='output', metavar='<file>', help='write the merged summary')
+    parser.add_argument(dest="summaries", help="the summary files of all shards", metavar="summary", nargs='+')
+    return parser.parse_args(args)
+
+
+def setup_logging(loglevel, stream=None):
     """Setup basic logging
 
     Args:
       loglevel (int): minimum loglevel for emitting messages
+      stream: stream for the messages (default: stdout)
     """
     logging.getLogger("pyvips").setLevel(logging.ERROR)
     logformat = "[%(asctime)s] %(levelname)s:%(name)s: %(message)s"
     logging.basicConfig(
-        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+        level=loglevel, stream=stream or sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
     )
 
 
@@ -462,7 +1825,39 @@ def main(args):
     Args:
       args (List[str]): command line parameters as list of strings
     """
+    if args and args[0] == 'batch':
+        args = parse_batch_args(args[1:])
+        jobs = read_jobs(args.jobs)
+        # keep stdout clean for the data if jobs stream to it
+        out = sys.stderr if batch_streams(jobs) else sys.stdout
+        setup_logging(args.loglevel, out)
+        summary = gwarp_batch(jobs)
+        print('batch: {jobs} jobs, {succeeded} succeeded, {failed} failed, '
+              '{outputs} files written, {indexes} indexes, {seconds}s'.format(**summary), file=out)
+        return summary
+
+    if args and args[0] == 'merge-shards':
+        args = parse_merge_args(args[1:])
+        summary = merge_shards(args.summaries)
+        if args.output:
+            write_summary(args.output, summary)
+        print(f"merge-shards: {len(summary['files'])} of {summary['src_count']} src files in {len(args.summaries)} summaries")
+        for problem in summary['problems']:
+            print(problem)
+        if summary['problems']:
+            sys.exit(1)
+        return summary
+
     args = parse_args(args)
+
+    if args.dst == '-':
+        # keep stdout clean for the data
+        args.dst = sys.stdout.buffer
+        setup_logging(args.loglevel, sys.stderr)
+        with contextlib.redirect_stdout(sys.stderr):
+            gwarp(args)
+        return
+
     setup_logging(args.loglevel)
     gwarp(args)
 
@@ -21,4 +21,20 @@ hyperfine.exe --export-csv ./out/modis1_multi.csv -r 2 ^
 -L r near,bilinear ^
 "gwarp -t_srs EPSG:3857 -overwrite -r {r} -multi -ts 2048 2048 -co lzw ./in/modis* ./out/bench1/{r}" "for %%f in (./in/modis*) do (gdalwarp -t_srs EPSG:3857 -overwrite -r {r} -multi -ts 2048 2048 -co compression=lzw -co predictor=2 ./in/%%~f ./out/bench1/gdal_%%~nf_{r}.tif)"
 
+hyperfine.exe --export-csv ./out/modis2_engine.csv -r 4 ^
+-L r near,bilinear -L e vips,numpy -L s 8192,16192 ^
+"gwarp -t_srs EPSG:3857 -overwrite -r {r} --engine {e} -ts 2048 2048 -co lzw ./in/modis_{s}.tif ./out/bench2/_{e}{s}_{r}"
 
+:: engine crossover around the '--engine auto' threshold (src of 512 to 4096 px, 1 and 3 bands, Byte and Float32);
+:: pass ./out/modis3_crossover.csv to gwarp with --engine-calibration
+if not exist .\in\engine mkdir .\in\engine
+for %%s in (512 1024 1536 2048 3072 4096) do (
+    if not exist ./in/engine/modis_%%s_3_uint8.tif gdal_translate -outsize %%s %%s -co compress=lzw ./in/modis_8192.tif ./in/engine/modis_%%s_3_uint8.tif
+    if not exist ./in/engine/modis_%%s_1_uint8.tif gdal_translate -outsize %%s %%s -b 1 -co compress=lzw ./in/modis_8192.tif ./in/engine/modis_%%s_1_uint8.tif
+    if not exist ./in/engine/modis_%%s_3_float32.tif gdal_translate -outsize %%s %%s -ot Float32 -co compress=lzw ./in/modis_8192.tif ./in/engine/modis_%%s_3_float32.tif
+    if not exist ./in/engine/modis_%%s_1_float32.tif gdal_translate -outsize %%s %%s -b 1 -ot Float32 -co compress=lzw ./in/modis_8192.tif ./in/engine/modis_%%s_1_float32.tif
+)
+
+hyperfine.exe --export-csv ./out/modis3_crossover.csv -r 8 -w 1 ^
+-L e vips,numpy -L s 512,1024,1536,2048,3072,4096 -L b 1,3 -L t uint8,float32 ^
+"gwarp -t_srs EPSG:3857 -overwrite -r bilinear --engine {e} -co lzw ./in/engine/modis_{s}_{b}_{t}.tif ./out/bench3/_{e}{s}_{b}_{t}"
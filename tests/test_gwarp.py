@@ -1,12 +1,18 @@
 import pytest
 
-from gwarp.gwarp import main, run, parse_args, parse_nif
+import gwarp.gwarp as gwarp_module
+from gwarp.gwarp import gwarp, gwarp_batch, nodata_params, main, run, parse_args, parse_nif, read_jobs, gdal_creation_options, read_index, read_vips_file, numpy_max_pixels, read_engine_calibration, shrink_on_load
 import os
 import sys
 import subprocess
 import glob
 import shutil
 import urllib.request
+import io
+import tarfile
+import threading
+import time
+import numpy as np
 from osgeo import gdal
     
     
@@ -301,3 +307,433 @@ def test_main_noData_bands(capsys):
     for file in outfiles:
         assert gdal.Open(file, gdal.GA_ReadOnly).RasterCount == 4
 
+def test_read_jobs(capsys):
+    path_jobs = path_out + 'jobs_read.jsonl'
+    if not os.path.exists(path_out):
+        os.makedirs(path_out)
+    with open(path_jobs, 'w') as file:
+        file.write('["-t_srs", "EPSG:3857", "-co", "lzw", "srcfile", "dstfile"]\n')
+        file.write('\n')
+        file.write('"-r bilinear -ts 1024 512 srcfile"\n')
+    jobs = read_jobs(path_jobs)
+    assert len(jobs) == 2
+    assert jobs[0].dstSRS == 'EPSG:3857' and jobs[0].co['compression'] == 'lzw' and jobs[0].dst == 'dstfile'
+    assert jobs[1].resampleAlg == 'bilinear' and jobs[1].widthHeight == [1024, 512] and jobs[1].dst == None
+
+    with open(path_jobs, 'w') as file:
+        file.write('["srcfile"]\n')
+        file.write('["--no-such-option", "srcfile"]\n')
+    with pytest.raises(ValueError, match='jobs_read.jsonl:2:'):
+        read_jobs(path_jobs)
+
+    with open(path_jobs, 'w') as file:
+        file.write('["srcfile"\n')
+    with pytest.raises(ValueError, match='jobs_read.jsonl:1:'):
+        read_jobs(path_jobs)
+
+def test_main_batch(capsys):
+    path_jobs = path_out + 'jobs.jsonl'
+    with open(path_jobs, 'w') as file:
+        file.write('["-t_srs", "EPSG:3857", "-co", "lzw", "-overwrite", "%s", "%s"]\n' % (path_in+'nodata/modis_allvalid.tif', path_out+'batch/allvalid.tif'))
+        file.write('["-t_srs", "EPSG:3857", "-co", "lzw", "-overwrite", "%s", "%s"]\n' % (path_in+'nodata/modis_nodata0.tif', path_out+'batch/nodata0.tif'))
+        file.write('["-t_srs", "EPSG:4326", "-co", "lzw", "-overwrite", "%s", "%s"]\n' % (path_in+'nodata/modis_nodata0.tif', path_out+'batch/nodata0_4326.tif'))
+        file.write('["does_not_exist.tif"]\n')
+    summary = main(['batch', path_jobs])
+    captured = capsys.readouterr()
+    assert 'batch: 4 jobs, 3 succeeded, 1 failed, 3 files written, 2 indexes' in captured.out
+    assert summary['indexes'] == 2
+    for file in ['allvalid.tif', 'nodata0.tif', 'nodata0_4326.tif']:
+        assert os.path.isfile(path_out+'batch/'+file)
+    assert gdal.Open(path_out+'batch/allvalid.tif').GetGeoTransform() == gdal.Open(path_out+'batch/nodata0.tif').GetGeoTransform()
+
+def test_gwarp_batch_evict(capsys, monkeypatch):
+    jobs = [parse_args(['-t_srs', 'EPSG:4326', '-co', 'lzw', '-overwrite', path_in+'nodata/modis_allvalid.tif', path_out+'batch_evict/allvalid_4326.tif']),
+            parse_args(['-t_srs', 'EPSG:3857', '-co', 'lzw', '-overwrite', path_in+'nodata/modis_allvalid.tif', path_out+'batch_evict/allvalid.tif']),
+            parse_args(['-t_srs', 'EPSG:3857', '-co', 'lzw', '-overwrite', path_in+'nodata/modis_nodata0.tif', path_out+'batch_evict/nodata0.tif'])]
+
+    # the indexes in the cache when each job starts
+    cached = []
+    warp = gwarp_module.gwarp
+    def gwarp_cached(args, indexCache):
+        cached.append(len(indexCache))
+        return warp(args, indexCache)
+    monkeypatch.setattr(gwarp_module, 'gwarp', gwarp_cached)
+
+    indexCache = {}
+    summary = gwarp_batch(jobs, indexCache)
+    assert summary['succeeded'] == 3 and summary['indexes'] == 2
+    # the EPSG:4326 index is dropped after its only job, the EPSG:3857 one after the last
+    assert cached == [0, 0, 1]
+    assert indexCache == {}
+
+def test_main_without_pyvips(capsys, monkeypatch):
+    src = path_in+'nodata/modis_nodata0.tif'
+    args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '-overwrite', '-dstnodata', '50']
+    main(args + ['--vio', path_out+'novips/index_vips.tif', src, path_out+'novips/vips.tif'])
+
+    # without libvips the index is created, written and read with numpy and gdal
+    monkeypatch.setattr(gwarp_module, 'load_pyvips', lambda: None)
+    main(args + ['--vio', path_out+'novips/index_numpy.tif', src, path_out+'novips/numpy.tif'])
+    main(['-co', 'lzw', '-overwrite', '-dstnodata', '50', '--vii', path_out+'novips/index_numpy.tif', src, path_out+'novips/numpy_vii.tif'])
+
+    index_vips = gdal.Open(path_out+'novips/index_vips.tif')
+    index_numpy = gdal.Open(path_out+'novips/index_numpy.tif')
+    assert index_numpy.GetProjection() == index_vips.GetProjection()
+    assert index_numpy.GetGeoTransform() == index_vips.GetGeoTransform()
+    assert index_numpy.GetMetadata()['SrcXSize'] == index_vips.GetMetadata()['SrcXSize']
+    assert (index_numpy.ReadAsArray() == index_vips.ReadAsArray()).all()
+
+    reference = gdal.Open(path_out+'novips/vips.tif')
+    for file in ['numpy.tif', 'numpy_vii.tif']:
+        dataset = gdal.Open(path_out+'novips/'+file)
+        assert dataset.GetProjection() == reference.GetProjection()
+        assert dataset.GetGeoTransform() == reference.GetGeoTransform()
+        assert dataset.RasterCount == reference.RasterCount
+        assert dataset.GetRasterBand(1).GetNoDataValue() == reference.GetRasterBand(1).GetNoDataValue() == 50
+        assert (dataset.ReadAsArray() == reference.ReadAsArray()).mean() > 0.99
+
+def test_main_batch_stdout(capsysbinary):
+    path_jobs = path_out + 'jobs_stdout.jsonl'
+    with open(path_jobs, 'w') as file:
+        file.write('["-t_srs", "EPSG:3857", "-co", "lzw", "%s", "-"]\n' % (path_in+'nodata/modis_allvalid.tif'))
+        file.write('["-t_srs", "EPSG:4326", "-co", "lzw", "%s", "-"]\n' % (path_in+'nodata/modis_nodata*.tif'))
+    summary = main(['batch', path_jobs])
+    assert summary['succeeded'] == 2 and summary['outputs'] == 3
+
+    # a single tar of all jobs, the src names and the summary go to stderr
+    captured = capsysbinary.readouterr()
+    with tarfile.open(fileobj=io.BytesIO(captured.out)) as tar:
+        names = tar.getnames()
+    assert len(names) == 3
+    assert b'batch: 2 jobs' in captured.err and b'batch:' not in captured.out
+
+def test_gdal_creation_options(capsys):
+    assert parse_args(['srcfile']).engine == 'vips'
+    assert parse_args(['--engine', 'auto', 'srcfile']).engine == 'auto'
+
+    assert gdal_creation_options({}) == []
+    assert gdal_creation_options({'compression': 'lzw'}) == ['COMPRESS=LZW', 'PREDICTOR=2']
+    assert gdal_creation_options({'compression': 'zstd', 'level': 9, 'predictor': 'none'}) == ['COMPRESS=ZSTD', 'ZSTD_LEVEL=9', 'PREDICTOR=1']
+    assert gdal_creation_options({'tile': 1, 'tile_width': 512, 'tile_height': 512}) == ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512']
+
+def test_main_engine(capsys):
+    for engine in ['numpy', 'auto']:
+        for r in ['near', 'bilinear']:
+            args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '-r', r, '-srcnodata', '50', '--engine', engine, path_in+'nodata/modis_nodata0.tif', path_out+f'engine/{engine}_{r}.tif']
+            print('\nargs:  '+' '.join(args))
+            main(args)
+
+    reference = gdal.Open(glob.glob(path_out+'nodata/modis_nodata0_srcnodata50.tif')[0], gdal.GA_ReadOnly)
+    for file in glob.glob(path_out+'engine/*.tif'):
+        dataset = gdal.Open(file, gdal.GA_ReadOnly)
+        assert dataset.GetProjection() == reference.GetProjection()
+        assert dataset.GetGeoTransform() == reference.GetGeoTransform()
+        assert dataset.RasterCount == reference.RasterCount
+        assert dataset.GetRasterBand(1).GetNoDataValue() == 50
+
+    near = gdal.Open(path_out+'engine/numpy_near.tif', gdal.GA_ReadOnly).ReadAsArray()
+    assert (near == reference.ReadAsArray()).mean() > 0.99
+
+def test_engine_calibration(capsys):
+    # the default crossover depends on band count and data type separately
+    assert numpy_max_pixels(1, 'uint8') > numpy_max_pixels(3, 'uint8') > numpy_max_pixels(3, 'float32')
+
+    os.makedirs(path_out+'engine', exist_ok=True)
+    with open(path_out+'engine/crossover.csv', 'w') as file:
+        file.write('command,mean,parameter_e,parameter_s,parameter_b,parameter_t\n')
+        for s, vips, numpy in [(512, 0.5, 0.1), (1024, 0.6, 0.3), (2048, 0.9, 1.2)]:
+            file.write(f'a,{vips},vips,{s},3,uint8\nb,{numpy},numpy,{s},3,uint8\n')
+        file.write('a,0.5,vips,512,1,float32\nb,0.7,numpy,512,1,float32\n')
+    calibration = read_engine_calibration(path_out+'engine/crossover.csv')
+    assert calibration == {(3, 'uint8'): 1024*1024, (1, 'float32'): 0}
+    assert numpy_max_pixels(3, 'uint8', calibration) == 1024*1024
+    assert numpy_max_pixels(1, 'float32', calibration) == 0
+
+def test_main_shrink(capsys):
+    assert parse_args(['srcfile']).shrink == 'auto'
+    for shrink in ['auto', 'off']:
+        for engine in ['vips', 'numpy']:
+            args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '-r', 'bilinear', '-ts', '512', '512', '--shrink', shrink, '--engine', engine, path_in+'modis_8192.tif', path_out+f'shrink/{engine}_{shrink}.tif']
+            print('\nargs:  '+' '.join(args))
+            main(args)
+            assert os.path.isfile(path_out+f'shrink/{engine}_{shrink}.tif')
+
+    for file in glob.glob(path_out+'shrink/*.tif'):
+        dataset = gdal.Open(file, gdal.GA_ReadOnly)
+        assert dataset.RasterXSize == 512 and dataset.RasterYSize == 512
+        assert dataset.GetGeoTransform() == gdal.Open(path_out+'shrink/vips_off.tif').GetGeoTransform()
+
+    # the shrunk src stays aligned with the full resolution one (no shift of a pixel or more)
+    for engine in ['vips', 'numpy']:
+        auto = gdal.Open(path_out+f'shrink/{engine}_auto.tif').ReadAsArray().astype(np.float64)
+        off = gdal.Open(path_out+f'shrink/{engine}_off.tif').ReadAsArray().astype(np.float64)
+        diff = np.abs(auto - off).mean()
+        assert diff < 16
+        assert diff < np.abs(auto[..., 1:] - off[..., :-1]).mean()
+        assert diff < np.abs(auto[..., :-1] - off[..., 1:]).mean()
+        assert diff < np.abs(auto[..., 1:, :] - off[..., :-1, :]).mean()
+        assert diff < np.abs(auto[..., :-1, :] - off[..., 1:, :]).mean()
+
+def test_main_nearest_smaller_src(capsys):
+    # a src smaller than the index grid (the largest src of the glob) is read at the same
+    # pixels by both engines with nearest
+    dataset = gdal.Open(path_in + 'nodata/modis_allvalid.tif')
+    os.makedirs(path_in + 'halfsize', exist_ok=True)
+    gdal.Translate(path_in + 'halfsize/full.tif', dataset)
+    gdal.Translate(path_in + 'halfsize/half.tif', dataset, width=dataset.RasterXSize // 2, height=dataset.RasterYSize // 2)
+
+    for engine in ['vips', 'numpy']:
+        args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '-overwrite', '-r', 'near', '--shrink', 'off', '--engine', engine, path_in + 'halfsize/*.tif', path_out + f'halfsize/{engine}']
+        print('\nargs:  '+' '.join(args))
+        main(args)
+
+    for name in ['full', 'half']:
+        vips = gdal.Open(path_out + f'halfsize/{name}_vips.tif').ReadAsArray()
+        numpy = gdal.Open(path_out + f'halfsize/{name}_numpy.tif').ReadAsArray()
+        assert (vips == numpy).mean() > 0.999
+
+def test_shrink_on_load_pages(capsys):
+    # a second page of the same size is a different image, not a pyramid level
+    path_pages = path_out + 'shrink/pages.tif'
+    os.makedirs(path_out+'shrink', exist_ok=True)
+    pages = (pyvips.Image.black(256, 256) + 10).cast('uchar').join((pyvips.Image.black(256, 256) + 200).cast('uchar'), 'vertical')
+    pages = pages.copy()
+    pages.set_type(pyvips.GValue.gint_type, 'page-height', 256)
+    pages.tiffsave(path_pages)
+
+    image = pyvips.Image.new_from_file(path_pages)
+    shrunk = shrink_on_load(path_pages, image, 4)
+    assert shrunk.width == 64 and shrunk.height == 64
+    assert shrunk.avg() == 10
+
+def test_parse_shard(capsys):
+    assert parse_args(['srcfile']).shard == None
+    assert parse_args(['--shard', '2/3', 'srcfile']).shard == [2, 3]
+    for shard in ['0/3', '4/3', '1', 'a/b']:
+        with pytest.raises(SystemExit):
+            parse_args(['--shard', shard, 'srcfile'])
+
+def test_main_shard(capsys):
+    path_shard_index = path_out + 'shard/index.tif'
+    for i in range(1, 4):
+        args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '--shard', f'{i}/3', '--vio', path_shard_index, '--summary', path_out+f'shard/summary_{i}.json', path_in+'nodata/*.tif', path_out+'shard/epsg3857']
+        print('\nargs:  '+' '.join(args))
+        main(args)
+
+    assert os.path.isfile(path_shard_index) and not os.path.isfile(path_shard_index + '.lock')
+    assert len(glob.glob(path_out+'shard/*_epsg3857.tif')) == 4
+
+    summaries = [path_out+f'shard/summary_{i}.json' for i in range(1, 4)]
+    summary = main(['merge-shards', '-o', path_out+'shard/merged.json'] + summaries)
+    assert summary['problems'] == [] and len(summary['files']) == 4
+    assert os.path.isfile(path_out+'shard/merged.json')
+
+    with pytest.raises(SystemExit):
+        main(['merge-shards'] + summaries[1:])
+
+def test_main_shard_stale_vio(capsys):
+    path_shard_index = path_out + 'shard_stale/index.tif'
+    src = [path_in+'nodata/*.tif']
+    main(['-t_srs', 'EPSG:3857', '-co', 'lzw', '-overwrite', '--vio', path_shard_index] + src + [path_out+'shard_stale/epsg3857'])
+    key3857 = gdal.Open(path_shard_index).GetMetadataItem('IndexKey')
+    assert key3857
+
+    # an index built with other parameters is rebuilt instead of reused
+    main(['-t_srs', 'EPSG:4326', '-co', 'lzw', '-overwrite', '--shard', '1/2', '--vio', path_shard_index] + src + [path_out+'shard_stale/epsg4326'])
+    dataset = gdal.Open(path_shard_index)
+    assert dataset.GetMetadataItem('IndexKey') != key3857
+    assert dataset.GetGeoTransform() == gdal.Open(glob.glob(path_out+'shard_stale/*_epsg4326.tif')[0]).GetGeoTransform()
+    assert not os.path.isfile(path_shard_index + '.lock')
+
+def test_main_shard_lock_wait(capsys):
+    path_shard_index = path_out + 'shard_lock/index.tif'
+    args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '-overwrite', '--vio', path_shard_index, path_in+'nodata/*.tif']
+    os.makedirs(path_out+'shard_lock', exist_ok=True)
+    for path in [path_shard_index, path_shard_index + '.lock']:
+        if os.path.exists(path):
+            os.remove(path)
+
+    # another shard holds the lock and builds the index in the background
+    open(path_shard_index + '.lock', 'w').close()
+    built = []
+    def build():
+        time.sleep(1.5)
+        main(args + [path_out+'shard_lock/builder'])
+        built.append(os.path.getmtime(path_shard_index))
+        os.remove(path_shard_index + '.lock')
+    builder = threading.Thread(target=build)
+    builder.start()
+
+    main(args[:-1] + ['--shard', '2/2', args[-1], path_out+'shard_lock/epsg3857'])
+    builder.join()
+
+    # the waiting shard read the index instead of building it
+    assert not os.path.isfile(path_shard_index + '.lock')
+    assert os.path.getmtime(path_shard_index) == built[0]
+    assert len(glob.glob(path_out+'shard_lock/*_epsg3857.tif')) == 2
+
+def test_main_vio_v(capsys):
+    path_index_v = path_out + 'index_base.v'
+    args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '-srcnodata', '235', '--vio', path_index_v, path_in + '../**/base*', path_out + 'base_v/epsg3857']
+    print('\nargs:  '+' '.join(args))
+    main(args)
+    assert os.path.isfile(path_index_v) and os.path.isfile(path_index_v + '.json')
+
+    index, projection, geotransform, xSize, ySize = read_index(path_index_v)
+    reference = gdal.Open(path_index)
+    assert projection == reference.GetProjection()
+    assert geotransform == reference.GetGeoTransform()
+    assert index.width == reference.RasterXSize and index.height == reference.RasterYSize
+    assert (read_vips_file(path_index_v) == reference.ReadAsArray().transpose(1, 2, 0)).all()
+
+    path_fileNO2 = path_out+'combNO2_3857_v.tif'
+    args = ['-co', 'lzw', '--vii', path_index_v, path_in+'combNO2.tif', path_fileNO2]
+    print('\nargs:  '+' '.join(args))
+    main(args)
+    dataset = gdal.Open(path_fileNO2, gdal.GA_ReadOnly)
+    assert dataset.GetGeoTransform() == reference.GetGeoTransform()
+    assert (dataset.ReadAsArray() == gdal.Open(path_out+'combNO2_3857.tif').ReadAsArray()).all()
+
+def test_gwarp_buffer(capsys):
+    for engine in ['vips', 'numpy']:
+        args = parse_args(['-t_srs', 'EPSG:3857', '-co', 'lzw', '-of', 'GTiff', '--engine', engine, path_in+'nodata/modis_nodata0.tif'])
+        args.dst = io.BytesIO()
+        outputs = gwarp(args)
+        assert len(outputs) == 1
+
+        path_buffer = f'/vsimem/test_buffer_{engine}.tif'
+        gdal.FileFromMemBuffer(path_buffer, args.dst.getvalue())
+        dataset = gdal.Open(path_buffer)
+        reference = gdal.Open(path_out+'nodata/modis_nodata0_nochange.tif')
+        assert dataset.GetProjection() == reference.GetProjection()
+        assert dataset.GetGeoTransform() == reference.GetGeoTransform()
+        assert dataset.GetRasterBand(1).GetNoDataValue() == 0
+        dataset = None
+        gdal.Unlink(path_buffer)
+
+def test_gwarp_dstNodata_scalar(capsys):
+    # API callers setting a single value instead of the list of parse_args
+    for engine in ['vips', 'numpy']:
+        args = parse_args(['-t_srs', 'EPSG:3857', '-co', 'lzw', '-overwrite', '--engine', engine, path_in+'nodata/modis_nodata0.tif', path_out+f'nodata/scalar_{engine}'])
+        args.dstNodata = 50
+        gwarp(args)
+        dataset = gdal.Open(glob.glob(path_out+f'nodata/scalar_{engine}*.tif')[0], gdal.GA_ReadOnly)
+        assert dataset.GetRasterBand(1).GetNoDataValue() == 50
+
+def test_main_stdout(capsysbinary):
+    args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', path_in+'nodata/*.tif', '-']
+    main(args)
+    captured = capsysbinary.readouterr()
+    with tarfile.open(fileobj=io.BytesIO(captured.out)) as tar:
+        names = tar.getnames()
+    assert len(names) == 4
+    assert all(name.endswith('_gwarp.tif') for name in names)
+    assert not os.path.exists('-')
+
+def test_main_mosaic(capsys):
+    file_org = path_in + 'nodata/modis_allvalid.tif'
+    dataset = gdal.Open(file_org)
+    half = dataset.RasterXSize // 2
+    if not os.path.exists(path_in + 'mosaic'):
+        os.makedirs(path_in + 'mosaic')
+    gdal.Translate(path_in + 'mosaic/left.tif', dataset, srcWin=[0, 0, half + 8, dataset.RasterYSize])
+    gdal.Translate(path_in + 'mosaic/right.tif', dataset, srcWin=[half - 8, 0, dataset.RasterXSize - half + 8, dataset.RasterYSize])
+
+    for mode in ['first', 'last', 'max']:
+        for engine in ['vips', 'numpy']:
+            path_mosaic = path_out + f'mosaic/{mode}_{engine}.tif'
+            args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '--mosaic', mode, '--engine', engine, path_in + 'mosaic/*.tif', path_mosaic]
+            print('\nargs:  '+' '.join(args))
+            main(args)
+            assert os.path.isfile(path_mosaic)
+
+    reference = gdal.Open(path_out + 'nodata/modis_allvalid_nochange.tif')
+    for file in glob.glob(path_out + 'mosaic/*.tif'):
+        dataset = gdal.Open(file)
+        assert dataset.GetProjection() == reference.GetProjection()
+        assert dataset.RasterCount == reference.RasterCount
+        assert abs(dataset.RasterXSize - reference.RasterXSize) <= 1
+        assert abs(dataset.RasterYSize - reference.RasterYSize) <= 1
+        assert (dataset.ReadAsArray() != 0).mean() > 0.9 * (reference.ReadAsArray() != 0).mean()
+
+def test_mosaic_overlap(capsys):
+    # the right file differs from the left one, so the overlap shows which pixel was kept
+    os.makedirs(path_in + 'mosaic_overlap', exist_ok=True)
+    shutil.copy(path_in + 'mosaic/left.tif', path_in + 'mosaic_overlap/left.tif')
+    darker = gdal.GetDriverByName('GTiff').CreateCopy(path_in + 'mosaic_overlap/right.tif', gdal.Open(path_in + 'mosaic/right.tif'))
+    for b in range(1, darker.RasterCount + 1):
+        band = darker.GetRasterBand(b)
+        band.WriteArray((band.ReadAsArray() // 2 + 64 + 32 * (b - 1)).astype(np.uint8))
+    darker = None
+
+    args = parse_args(['-t_srs', 'EPSG:3857', '-overwrite', '--mosaic', 'first', path_in + 'mosaic_overlap/*.tif', path_out + 'mosaic_overlap/grid.tif'])
+    indexCache = {}
+    gwarp(args, indexCache)
+    grid = gdal.Open(path_out + 'mosaic_overlap/grid.tif')
+    geotransform = grid.GetGeoTransform()
+    te = [geotransform[0], geotransform[3] + geotransform[5] * grid.RasterYSize,
+          geotransform[0] + geotransform[1] * grid.RasterXSize, geotransform[3]]
+    ts = [str(grid.RasterXSize), str(grid.RasterYSize)]
+
+    # the index of each file only covers its window of the mosaic
+    assert len(indexCache) == 2
+    for index, _, _ in indexCache.values():
+        indexWidth = index.width if isinstance(index, pyvips.Image) else index.shape[1]
+        assert indexWidth < 0.75 * grid.RasterXSize
+
+    for engine in ['vips', 'numpy']:
+        def mosaic(mode, src, dst):
+            path = path_out + f'mosaic_overlap/{dst}_{engine}.tif'
+            main(['-t_srs', 'EPSG:3857', '-te'] + [str(v) for v in te] + ['-ts'] + ts +
+                 ['-overwrite', '--engine', engine, '--mosaic', mode, path_in + 'mosaic_overlap/' + src, path])
+            return np.moveaxis(gdal.Open(path).ReadAsArray(), 0, -1).astype(np.int64)
+
+        left = mosaic('first', 'left.tif', 'left')
+        right = mosaic('first', 'right.tif', 'right')
+        first = mosaic('first', '*.tif', 'first')
+        last = mosaic('last', '*.tif', 'last')
+        brightest = mosaic('max', '*.tif', 'max')
+
+        overlap = (left != 0).any(axis=-1) & (right != 0).any(axis=-1)
+        assert overlap.sum() > 0
+        assert (first[overlap] == left[overlap]).all()
+        assert (last[overlap] == right[overlap]).all()
+        # whole pixels of one file, the one with the larger sum of its bands
+        whole = (brightest[overlap] == left[overlap]).all(axis=-1) | (brightest[overlap] == right[overlap]).all(axis=-1)
+        assert whole.all()
+        assert (brightest[overlap].sum(axis=-1) == np.maximum(left[overlap].sum(axis=-1), right[overlap].sum(axis=-1))).all()
+
+def test_nodata_params(capsys):
+    assert parse_args(['srcfile']).dstNodata == None
+    assert parse_args(['-dstnodata', '50', 'srcfile']).dstNodata == [50]
+    assert parse_args(['-dstnodata', '0 0 255', 'srcfile']).dstNodata == [0, 0, 255]
+    assert parse_args(['-dstnodata', 'None', 'srcfile']).dstNodata is None
+
+    assert nodata_params(None, None, 3) == (None, False)
+    assert nodata_params([0], None, 3) == ([0, 0, 0], False)
+    assert nodata_params([50], None, 3) == ([50, 50, 50], True)
+    assert nodata_params([1, 2], None, 3) == ([1, 2, 2], True)
+    assert nodata_params(None, [0], 3) == ([0, 0, 0], False)
+    assert nodata_params(None, [0, 0, 255], 3) == ([0, 0, 255], True)
+    assert nodata_params([50], [0], 3) == ([0, 0, 0], True)
+    assert nodata_params(None, [None], 3) == (None, False)
+    assert nodata_params([None], None, 3) == (None, False)
+    assert nodata_params([50], [None], 3) == ([50, 50, 50], True)
+    # single values of API callers
+    assert nodata_params(None, 50, 3) == ([50, 50, 50], True)
+    assert nodata_params(0, None, 2) == ([0, 0], False)
+    assert nodata_params(50, 0, 2) == ([0, 0], True)
+
+def test_main_noData_multi(capsys):
+    for engine in ['vips', 'numpy']:
+        args = ['-t_srs', 'EPSG:3857', '-co', 'lzw', '-srcnodata', '0', '0', '0', '-dstnodata', '1 2 3', '--engine', engine, '--', path_in+'nodata/modis_nodata0.tif', path_out+f'nodata/multi_{engine}.tif']
+        print('\nargs:  '+' '.join(args))
+        main(args)
+
+    for engine in ['vips', 'numpy']:
+        dataset = gdal.Open(path_out+f'nodata/multi_{engine}.tif', gdal.GA_ReadOnly)
+        assert dataset.GetRasterBand(1).GetNoDataValue() == 1
+        image = dataset.ReadAsArray()
+        empty = (image[0] == 1) & (image[1] == 2) & (image[2] == 3)
+        assert empty[0, 0] and empty.any() and not empty.all()
+        assert not ((image == 0).all(axis=0)).any()